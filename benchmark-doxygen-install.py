@@ -0,0 +1,120 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+##
+## This script compares the ways doxygen output reaches the doc dir
+##
+## A synthetic doxygen output of --files small files is written
+## - directly into the doc dir, as doxygen does with doxy_staging = off
+## - to a staging dir below --tempdir and synced into the doc dir
+##   (doxy_staging = sync), once into an empty folder, once unchanged and
+##   once with --changed of the files changed
+## - to a staging dir and swapped into the doc dir (doxy_staging = swap)
+## Point --docdir to the file system of $TAPASDOC, e.g. a NFS mount, and
+## --tempdir to local scratch or tmpfs to measure the real setup.
+##
+## Example: python benchmark-doxygen-install.py --files 20000 --docdir /nfs/docs
+##
+## Copyright (c) 2014 Tobias Pook
+##
+## Permission is hereby granted, free of charge, to any person obtaining a copy
+## of this software and associated documentation files (the "Software"), to deal
+## in the Software without restriction, including without limitation the rights
+## to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+## copies of the Software, and to permit persons to whom the Software is
+## furnished to do so, subject to the following conditions:
+##
+## The above copyright notice and this permission notice shall be included in
+## all copies or substantial portions of the Software.
+##
+## THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+## IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+## FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+## AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+## LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+## OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+## THE SOFTWARE.
+
+import os
+import argparse
+import shutil
+import tempfile
+import time
+
+from githookcontroller import _sync_directory, _swap_directory
+
+
+## Write a synthetic doxygen output
+#
+# Files are spread over html/ and html/search/ like the output of doxygen.
+#
+# @param outputdir directory to write to
+# @param args parsed command line arguments
+# @param version files with index below args.changed * args.files get this content version
+# @returns number of written bytes
+def write_output(outputdir, args, version = 0):
+    nbytes = 0
+    nchanged = int(args.changed * args.files)
+    for i in xrange(args.files):
+        folder = os.path.join(outputdir, 'html', 'search' if i % 10 == 0 else '')
+        if not os.path.isdir(folder):
+            os.makedirs(folder)
+        content = ('file %d version %d\n' % (i, version if i < nchanged else 0)).ljust(args.size, 'x')
+        with open(os.path.join(folder, 'page%06d.html' % i), 'wb') as page:
+            page.write(content)
+        nbytes += len(content)
+    return nbytes
+
+
+## Print the result of one measurement
+#
+# @param name name of the measurement
+# @param elapsed seconds
+# @param nfiles number of files in the output
+# @param nwritten number of files written to the doc dir
+# @param nbytes bytes written to the doc dir
+def report(name, elapsed, nfiles, nwritten, nbytes):
+    print '%-22s %7.2fs  %6d of %6d files written  %8.1f MB/s  %8.0f files/s' % \
+        (name, elapsed, nwritten, nfiles, nbytes / 1e6 / max(elapsed, 1e-6), nfiles / max(elapsed, 1e-6))
+
+
+def main():
+    parser = argparse.ArgumentParser(description = 'Compare direct writes of doxygen output with staged sync and swap')
+    parser.add_argument('--files', type = int, default = 20000, help = 'number of output files')
+    parser.add_argument('--size', type = int, default = 4096, help = 'size of each file in bytes')
+    parser.add_argument('--changed', type = float, default = 0.05, help = 'fraction of files changed by a rebuild')
+    parser.add_argument('--docdir', default = None, help = 'directory on the file system of the doc dir, default: --tempdir')
+    parser.add_argument('--tempdir', default = None, help = 'directory for the staging dirs, default: /tmp/')
+    args = parser.parse_args()
+
+    docdir = tempfile.mkdtemp(prefix = 'githookcontroller-bench-doc-', dir = args.docdir)
+    staging = tempfile.mkdtemp(prefix = 'githookcontroller-bench-stage-', dir = args.tempdir)
+    try:
+        start = time.time()
+        nbytes = write_output(os.path.join(docdir, 'direct'), args)
+        report('direct', time.time() - start, args.files, args.files, nbytes)
+
+        start = time.time()
+        nbytes = write_output(staging, args)
+        staged = time.time()
+        report('staging (tempdir)', staged - start, args.files, args.files, nbytes)
+        nfiles, nwritten, nbytes = _sync_directory(staging, os.path.join(docdir, 'sync'))
+        report('sync, first build', time.time() - staged, nfiles, nwritten, nbytes)
+
+        start = time.time()
+        nfiles, nwritten, nbytes = _sync_directory(staging, os.path.join(docdir, 'sync'))
+        report('sync, unchanged', time.time() - start, nfiles, nwritten, nbytes)
+
+        write_output(staging, args, version = 1)
+        start = time.time()
+        nfiles, nwritten, nbytes = _sync_directory(staging, os.path.join(docdir, 'sync'))
+        report('sync, %.0f%% changed' % (args.changed * 100), time.time() - start, nfiles, nwritten, nbytes)
+
+        start = time.time()
+        nfiles, nwritten, nbytes = _swap_directory(staging, os.path.join(docdir, 'swap'))
+        report('swap', time.time() - start, nfiles, nwritten, nbytes)
+    finally:
+        shutil.rmtree(docdir, ignore_errors = True)
+        shutil.rmtree(staging, ignore_errors = True)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,158 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+##
+## This script measures the pre-push checks for pushes of many refs
+##
+## A repo with a linear history of --commits commits and --refs branches
+## on top of it (one commit each, every second one changing a .cc file)
+## is pushed to a local bare repo with 'git push --all'. The pre-push
+## hook of the repo is this script: it parses the hook input, runs the
+## per ref tasks of pre-push.py with check_push and rejects the push, so
+## the measurement can be repeated. With --tracking the history is pushed
+## before, so only the branch commits are new to the remote.
+##
+## Example: python benchmark-pre-push.py --refs 10000 --commits 2000
+##
+## Copyright (c) 2014 Tobias Pook
+##
+## Permission is hereby granted, free of charge, to any person obtaining a copy
+## of this software and associated documentation files (the "Software"), to deal
+## in the Software without restriction, including without limitation the rights
+## to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+## copies of the Software, and to permit persons to whom the Software is
+## furnished to do so, subject to the following conditions:
+##
+## The above copyright notice and this permission notice shall be included in
+## all copies or substantial portions of the Software.
+##
+## THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+## IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+## FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+## AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+## LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+## OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+## THE SOFTWARE.
+
+import sys, os
+import argparse
+import json
+import shutil
+import subprocess
+import tempfile
+import time
+
+# set for the hook by the benchmark, the hook writes its timing there
+RESULT_ENV = 'GITHOOKCONTROLLER_BENCHMARK_RESULT'
+
+
+## Run the per ref tasks of pre-push.py as pre-push hook and store the timing
+#
+def run_hook():
+    start = time.time()
+    from githookcontroller import GitHookController, ref_needs_docs, ref_unverified_lint
+    gitController = GitHookController()
+    push = gitController.parse_pre_push()
+    parsed = time.time()
+    verdict = gitController.check_push( push, [ref_needs_docs, ref_unverified_lint] )
+    checked = time.time()
+    result = {'refs' : len(push.commits),
+              'new_commits' : len(push.new_commits.parents),
+              'changed_files' : len(push.changed_files),
+              'refs_with_docs' : sum(1 for result in verdict.of_task(ref_needs_docs) if result.value),
+              'passed' : verdict.passed,
+              'parse' : parsed - start,
+              'check' : checked - parsed}
+    with open(os.environ[RESULT_ENV], 'w') as result_file:
+        json.dump(result, result_file)
+    # reject the push, nothing needs to be transferred
+    sys.exit(1)
+
+
+## Write the fast-import stream of the benchmark history
+#
+# @param stream stdin of git fast-import
+# @param ncommits number of commits of the master branch
+# @param nrefs number of branches
+def write_history(stream, ncommits, nrefs):
+    def commit(ref, mark, parent, path):
+        stream.write('commit %s\nmark :%d\n' % (ref, mark))
+        stream.write('committer Bench <bench@localhost> %d +0000\n' % (1400000000 + mark))
+        message = 'commit %d' % mark
+        stream.write('data %d\n%s\n' % (len(message), message))
+        if parent:
+            stream.write('from :%d\n' % parent)
+        stream.write('M 100644 inline %s\ndata %d\n%d\n' % (path, len(str(mark)) + 1, mark))
+
+    for i in xrange(1, ncommits + 1):
+        commit('refs/heads/master', i, i - 1, 'src/file%d.%s' % (i % 100, 'cc' if i % 2 else 'txt'))
+    for i in xrange(nrefs):
+        mark = ncommits + 1 + i
+        commit('refs/heads/branch%05d' % i, mark, 1 + (i * ncommits) // nrefs,
+               'branches/branch%05d.%s' % (i, 'cc' if i % 2 else 'txt'))
+    stream.close()
+
+
+## Create the benchmark repos
+#
+# @param workdir directory for the repo and the bare remote
+# @param args parsed command line arguments
+# @returns path of the repo
+def create_repos(workdir, args):
+    repo = os.path.join(workdir, 'repo')
+    remote = os.path.join(workdir, 'remote.git')
+    subprocess.check_call(['git', 'init', '-q', repo])
+    subprocess.check_call(['git', 'init', '-q', '--bare', remote])
+    proc = subprocess.Popen(['git', 'fast-import', '--quiet'], stdin=subprocess.PIPE, cwd=repo)
+    write_history(proc.stdin, args.commits, args.refs)
+    if proc.wait() != 0:
+        sys.exit('git fast-import failed')
+    subprocess.check_call(['git', 'checkout', '-q', '-f', 'master'], cwd=repo)
+    subprocess.check_call(['git', 'remote', 'add', 'bench', remote], cwd=repo)
+    if args.tracking:
+        subprocess.check_call(['git', 'push', '-q', 'bench', 'master'], cwd=repo)
+    # the controller reads its config from hooks/ of the repo
+    here = os.path.dirname(os.path.abspath(__file__))
+    os.symlink(here, os.path.join(repo, 'hooks'))
+    os.symlink(os.path.abspath(__file__), os.path.join(repo, '.git', 'hooks', 'pre-push'))
+    return repo
+
+
+def main():
+    parser = argparse.ArgumentParser(description = 'Measure the pre-push checks for pushes of many refs')
+    parser.add_argument('--refs', type = int, default = 10000, help = 'number of pushed branches')
+    parser.add_argument('--commits', type = int, default = 2000, help = 'number of commits below the branches')
+    parser.add_argument('--tracking', action = 'store_true', help = 'push the history before, so the remote tracking branch knows it')
+    parser.add_argument('--repeat', type = int, default = 3, help = 'number of measured pushes')
+    parser.add_argument('--keep', action = 'store_true', help = 'keep the created repos')
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix = 'githookcontroller-bench-')
+    try:
+        start = time.time()
+        repo = create_repos(workdir, args)
+        print 'Created %d commits and %d branches in %.1fs' % (args.commits + args.refs, args.refs, time.time() - start)
+        env = dict(os.environ)
+        env[RESULT_ENV] = os.path.join(workdir, 'result.json')
+        for i in xrange(args.repeat):
+            start = time.time()
+            with open(os.devnull, 'w') as devnull:
+                subprocess.call(['git', 'push', '--all', 'bench'], cwd=repo, env=env, stderr=devnull)
+            total = time.time() - start
+            if not os.path.exists(env[RESULT_ENV]):
+                sys.exit('The pre-push hook did not run')
+            with open(env[RESULT_ENV]) as result_file:
+                result = json.load(result_file)
+            os.remove(env[RESULT_ENV])
+            print ('refs %(refs)d, new commits %(new_commits)d, changed files %(changed_files)d, '
+                   'refs with docs %(refs_with_docs)d, parse %(parse).2fs, check %(check).2fs' % result
+                   + ', git push %.2fs' % total)
+    finally:
+        if args.keep:
+            print 'Repos kept in %s' % workdir
+        else:
+            shutil.rmtree(workdir)
+
+if __name__ == '__main__':
+    if RESULT_ENV in os.environ:
+        run_hook()
+    main()
@@ -24,8 +24,29 @@
 ## THE SOFTWARE.
 
 import sys, os
+import re
 import shutil
-from  collections import namedtuple
+import bisect
+import fnmatch
+import shlex
+import fcntl
+import hashlib
+import tempfile
+import contextlib
+import json
+import signal
+import errno
+import time
+import threading
+import difflib
+import itertools
+from itertools import izip_longest
+import atexit
+import pkgutil
+import multiprocessing
+from multiprocessing.pool import ThreadPool
+from StringIO import StringIO
+from  collections import namedtuple, OrderedDict, deque
 import parser
 import argparse
 import subprocess
@@ -43,10 +64,1630 @@ formatter = logging.Formatter( '%(levelname)s (%(name)s): %(message)s' )
 ch.setFormatter( formatter )
 log.addHandler( ch )
 
-Push = namedtuple('Push', ['commits', 'remote_name', 'remote_url',
-                           'current_branch', 'removing_remote', 'forcing'])
+
+
+## Information about a push as passed to the pre-push hook
+#
+# Besides the fields parsed from the hook input, the commits new to the
+# remote are available per ref. They are computed on first access for all
+# refs at once.
+class Push(namedtuple('Push', ['commits', 'remote_name', 'remote_url',
+                               'current_branch', 'removing_remote', 'forcing'])):
+
+    ## Commits which the remote does not know yet, per pushed ref
+    #
+    # Commits reachable from any remote tracking branch of the remote or
+    # from the old remote SHA of an updated ref are considered known.
+    # Deleted refs have no new commits, new branches get all commits not
+    # yet on the remote.
+    #
+    # @param self The object pointer
+    # @returns NewCommits object mapping remote refs to lists of commit SHAs
+    @property
+    def new_commits(self):
+        if '_new_commits' not in self.__dict__:
+            self.__dict__['_new_commits'] = _new_commits_per_ref(self.commits, self.remote_name)
+        return self.__dict__['_new_commits']
+
+    ## Files changed by the new commits of all pushed refs
+    #
+    # Each commit is compared to its first parent, so merges only list the
+    # files they bring into the pushed branch.
+    #
+    # @param self The object pointer
+    # @returns ChangedFiles object
+    @property
+    def changed_files(self):
+        if '_changed_files' not in self.__dict__:
+            self.__dict__['_changed_files'] = _changed_files_of_commits(self.new_commits.parents)
+        return self.__dict__['_changed_files']
+
 Commit = namedtuple('Commit', ['local_ref', 'local_sha1', 'remote_ref', 'remote_sha1',
                                'local_branch', 'remote_branch'])
+ChangedFile = namedtuple('ChangedFile', ['status', 'score', 'src', 'dst'])
+RefResult = namedtuple('RefResult', ['commit', 'task', 'passed', 'message', 'value'])
+LintFinding = namedtuple('LintFinding', ['path', 'line', 'category', 'confidence', 'message'])
+DoxygenWarning = namedtuple('DoxygenWarning', ['path', 'line', 'kind', 'message'])
+# total and new warnings of a build, new holds the first new ones only
+DoxygenCheck = namedtuple('DoxygenCheck', ['total', 'nnew', 'new', 'counts'])
+
+# hunk header of a unified diff: @@ -old_start[,old_count] +new_start[,new_count] @@
+HUNK_HEADER = re.compile(r'^@@ -\d+(?:,(\d+))? \+(\d+)(?:,(\d+))? @@')
+# one finding as printed by cpplint: path:line:  message  [category] [confidence]
+CPPLINT_LINE = re.compile(r'^(.*?):(\d+):\s+(.*?)\s+\[([^\]]+)\]\s+\[(\d)\]\s*$')
+# one finding as printed by pep8 / pycodestyle / flake8: path:line:column: code message
+PEP8_LINE = re.compile(r'^(.*?):(\d+):(\d+): (\S+) (.*)$')
+# cpplint lines which are neither findings nor errors
+CPPLINT_NOISE = ('Done processing', 'Total errors found', 'Ignoring')
+
+# placeholders of the doc templates: +++token+++, ++token++ and %token%
+TEMPLATE_TOKEN = re.compile(r'\+\+\+\w+\+\+\+|\+\+\w+\+\+|%\w+%')
+
+# doxygen warning: <file>:<line>: [warning|error|note:] <message>
+DOXYGEN_WARNING_LINE = re.compile(r'^(?P<path>.+?):(?P<line>\d+):\s*(?:(?P<kind>warning|error|note):)?(?P<message>.*)$')
+# doxygen warning without location, e.g. about the config
+DOXYGEN_WARNING_KIND = re.compile(r'^(warning|error|note):\s*')
+
+# manifest of the branches with documentation in the folder of a repo on gh-pages
+BRANCH_MANIFEST = 'branches.json'
+
+# variables set for hooks which tie git commands to the repo of the hook
+GIT_REPO_ENV = ('GIT_INDEX_FILE', 'GIT_DIR', 'GIT_WORK_TREE', 'GIT_PREFIX')
+
+# tree without files, the parent of root commits in diffs
+EMPTY_TREE = '4b825dc642cb6eb9a060e54bf8d69288fbee4904'
+
+# ref of the last gh-pages commit written by git fast-import in the doc repo
+PUBLISH_REF = 'refs/githookcontroller/gh-pages'
+
+# build stamp and saved warnings of the last doxygen build in doc_<branch>/
+DOXYGEN_STAMP = '.doxygen_stamp'
+DOXYGEN_WARN_COPY = '.doxygen_warn'
+# files in doc_<branch>/ changed by synced builds since the last checkout publish
+DOXYGEN_INDEX_HINTS = '.doxygen_changed'
+# files of the controller in doc_<branch>/, they are neither published nor deduplicated
+DOXYGEN_PRIVATE_PREFIX = '.doxygen_'
+# warning log of doxygen as set in the doxy_cfg template
+DOXYGEN_WARN_PATH = './doc/doxy.warn'
+
+# doxygen settings which do not change the output, see _doxygen_cfg_digest
+DOXYGEN_UNSTAMPED_TAGS = re.compile(r'^\s*(HTML_HEADER|HTML_FOOTER|NUM_PROC_THREADS|DOT_NUM_THREADS)\s*\+?=')
+
+# files doxygen documents, a push changing none of them needs no new docs.
+# The default FILE_PATTERNS of doxygen plus *.tcc for template definitions
+DOXYGEN_PATTERNS = ['*.c', '*.cc', '*.cxx', '*.cpp', '*.c++', '*.java', '*.ii', '*.ixx',
+                    '*.ipp', '*.i++', '*.inl', '*.idl', '*.ddl', '*.odl', '*.h', '*.hh',
+                    '*.hxx', '*.hpp', '*.h++', '*.tcc', '*.cs', '*.d', '*.php', '*.php4',
+                    '*.php5', '*.phtml', '*.inc', '*.m', '*.markdown', '*.md', '*.mm',
+                    '*.dox', '*.py', '*.pyw', '*.f90', '*.f95', '*.f03', '*.f08', '*.f',
+                    '*.for', '*.tcl', '*.vhd', '*.vhdl', '*.ucf', '*.qsf', '*.ice']
+
+# builtin linters, these may be overridden or extended per repo in a
+# [[[linters]]] subsection. Only cpplint is enabled if a repo does not
+# configure its linters.
+DEFAULT_LINTERS = OrderedDict([
+    ('cpplint', {'command' : 'cpplint.py --linelength=200',
+                 'engine' : 'python',
+                 'module' : 'cpplint',
+                 'args' : '--linelength=200',
+                 'patterns' : ['*.cc', '*.hh', '*.h', '*.cpp', '*.cxx', '*.hpp'],
+                 'format' : 'cpplint',
+                 'batch' : True,
+                 'max_procs' : 4,
+                 # header guards and include checks depend on the file path
+                 'path_sensitive' : True}),
+    ('pep8', {'command' : 'pep8 --max-line-length=200',
+              'patterns' : ['*.py'],
+              'format' : 'pep8',
+              'batch' : True,
+              'max_procs' : 2}),
+])
+
+
+## Remove c-style quoting git applies to paths with special characters
+#
+# @param path path as printed by git
+# @returns the unquoted path
+def _unquote_git_path(path):
+    if len(path) > 1 and path.startswith('"') and path.endswith('"'):
+        return path[1:-1].decode('string_escape')
+    return path
+
+
+## Split a stream of NUL terminated fields
+#
+# The stream is read in chunks, so memory use does not depend on the
+# amount of output.
+#
+# @param stream file like object, e.g. stdout of a git command with -z
+# @param chunksize number of bytes read at once
+# @returns generator of fields without the NUL terminator
+def _iter_nul_fields(stream, chunksize = 65536):
+    rest = ''
+    while True:
+        chunk = stream.read(chunksize)
+        if not chunk:
+            break
+        fields = (rest + chunk).split('\0')
+        rest = fields.pop()
+        for field in fields:
+            yield field
+    if rest:
+        yield rest
+
+
+## Get the branch name of a ref
+#
+# @param ref full ref name, e.g. refs/heads/feature/x
+# @returns name below refs/heads/ for branches (feature/x), the full ref
+#          for other refs and None if the string is no ref, e.g. (delete)
+def _branch_name(ref):
+    if ref.startswith('refs/heads/'):
+        return intern(ref[len('refs/heads/'):])
+    if '/' in ref:
+        return ref
+    return None
+
+
+## Check if a SHA is git's null SHA used for missing refs
+#
+# @param sha hex object name
+# @returns True if the SHA only consists of zeros
+def _is_null_sha(sha):
+    return sha.strip('0') == ''
+
+
+## Peel annotated tags to the commits they point to
+#
+# @param shas list of object names
+# @returns dict mapping each object name to a commit SHA or None
+def _peel_to_commits(shas):
+    proc = subprocess.Popen(['git', 'cat-file', '--batch-check=%(objectname)'],
+                            stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+    stdout = proc.communicate(''.join('%s^{commit}\n' % sha for sha in shas))[0]
+    peeled = {}
+    for sha, line in zip(shas, stdout.splitlines()):
+        peeled[sha] = None if line.endswith(' missing') else line.strip()
+    return peeled
+
+
+## Enumerate the commits a push adds to a remote
+#
+# Runs a single 'git rev-list --parents --stdin' for the local SHAs of all
+# refs, excluding everything reachable from the remote tracking branches
+# and from the old remote SHAs of updated refs which exist locally.
+#
+# @param commits list of Commit namedtuples
+# @param remote_name name of the remote
+# @returns NewCommits object
+def _new_commits_per_ref(commits, remote_name):
+    heads = OrderedDict()
+    known = set()
+    for commit in commits:
+        if not _is_null_sha(commit.remote_sha1):
+            known.add(commit.remote_sha1)
+        if commit.local_ref == '(delete)' or _is_null_sha(commit.local_sha1):
+            continue
+        heads[commit.remote_ref] = commit.local_sha1
+    tags = [sha for ref, sha in heads.items() if ref.startswith('refs/tags/')]
+    if tags:
+        peeled = _peel_to_commits(tags)
+        for ref, sha in heads.items():
+            if sha in peeled:
+                heads[ref] = peeled[sha]
+    starts = set(sha for sha in heads.values() if sha is not None)
+    parents = OrderedDict()
+    if starts:
+        # the remote may have moved on, only SHAs known here can be excluded
+        known = set(sha for sha in _peel_to_commits(list(known)).values() if sha is not None) if known else known
+        cmd = ['git', 'rev-list', '--topo-order', '--parents', '--stdin', '--not', '--remotes=%s' % remote_name]
+        proc = subprocess.Popen(cmd, stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+        stdout = proc.communicate(''.join(sha + '\n' for sha in starts)
+                                  + ''.join('^%s\n' % sha for sha in known))[0]
+        for line in stdout.splitlines():
+            shas = line.split()
+            parents[shas[0]] = shas[1:]
+    return NewCommits(heads, parents)
+
+
+## Commits a push adds to a remote, per pushed ref
+#
+# All new commits and their parents are enumerated once. The list of
+# commits of a ref is only built when it is asked for, questions about all
+# refs, like which of them contain a certain commit, are answered by a
+# single pass over the parent links with reaching() or owned().
+class NewCommits(object):
+
+    ## The constructor.
+    #
+    # @param self The object pointer
+    # @param heads OrderedDict mapping remote refs to the pushed commit SHAs
+    # @param parents OrderedDict mapping new commits to their parents, children first
+    def __init__(self, heads, parents):
+        self.heads = heads
+        self.parents = parents
+        self._lists = {}
+        self._reaching = {}
+        self._order = None
+        self._owned = None
+        self._lock = threading.Lock()
+
+    ## Get the new commits of a ref
+    #
+    # @param self The object pointer
+    # @param ref remote ref name
+    # @param default value returned for refs without pushed commit
+    # @returns list of commit SHAs, newest first
+    def get(self, ref, default = None):
+        if ref not in self.heads:
+            return default
+        if ref not in self._lists:
+            start = self.heads[ref]
+            reachable = set()
+            todo = [start] if start in self.parents else []
+            while todo:
+                sha = todo.pop()
+                if sha in reachable:
+                    continue
+                reachable.add(sha)
+                todo.extend(parent for parent in self.parents[sha] if parent in self.parents)
+            if self._order is None:
+                self._order = dict((sha, index) for index, sha in enumerate(self.parents))
+            self._lists[ref] = sorted(reachable, key = self._order.get)
+        return self._lists[ref]
+
+    ## Get all new commits from which any of the given commits is reachable
+    #
+    # The result is cached, pass the same frozenset for repeated questions.
+    #
+    # @param self The object pointer
+    # @param shas frozenset of commit SHAs
+    # @returns frozenset of commit SHAs
+    def reaching(self, shas):
+        with self._lock:
+            if shas not in self._reaching:
+                reached = set()
+                # parents come after their children, so walk backwards
+                for sha in reversed(self.parents):
+                    if sha in shas or not reached.isdisjoint(self.parents[sha]):
+                        reached.add(sha)
+                self._reaching[shas] = frozenset(reached)
+        return self._reaching[shas]
+
+    ## Check if any of the given commits is among the new commits of a ref
+    #
+    # @param self The object pointer
+    # @param ref remote ref name
+    # @param shas frozenset of commit SHAs
+    # @returns boolean
+    def reaches(self, ref, shas):
+        return self.heads.get(ref) in self.reaching(shas)
+
+    ## Get the new commits of a ref which no ref pushed before it contains
+    #
+    # Every new commit belongs to exactly one ref, so work per commit can be
+    # split between the refs without doing it twice. The owners of all
+    # commits are found by walking from the heads in push order, never
+    # visiting a commit twice.
+    #
+    # @param self The object pointer
+    # @param ref remote ref name
+    # @returns list of commit SHAs
+    def owned(self, ref):
+        with self._lock:
+            if self._owned is None:
+                owned = {}
+                seen = set()
+                for head_ref, start in self.heads.items():
+                    commits = owned[head_ref] = []
+                    todo = [start] if start in self.parents and start not in seen else []
+                    seen.update(todo)
+                    while todo:
+                        sha = todo.pop()
+                        commits.append(sha)
+                        for parent in self.parents[sha]:
+                            if parent in self.parents and parent not in seen:
+                                seen.add(parent)
+                                todo.append(parent)
+                self._owned = owned
+        return self._owned.get(ref, [])
+
+    ## Check if a ref brings no new commits, e.g. a new branch of a known commit
+    #
+    # @param self The object pointer
+    # @param ref remote ref name
+    # @returns boolean
+    def empty(self, ref):
+        return self.heads.get(ref) not in self.parents
+
+    def __getitem__(self, ref):
+        if ref not in self.heads:
+            raise KeyError(ref)
+        return self.get(ref)
+
+    def __contains__(self, ref):
+        return ref in self.heads
+
+    def __iter__(self):
+        return iter(self.heads)
+
+    def __len__(self):
+        return len(self.heads)
+
+
+## Path indexed set of files changed by a group of commits
+#
+# Besides lookups by path, the files can be queried by glob patterns,
+# e.g. to skip work if only files of no interest were changed.
+class ChangedFiles(object):
+
+    ## The constructor.
+    #
+    # @param self The object pointer
+    def __init__(self):
+        self.paths = {}
+        self.by_commit = {}
+        self._commits_matching = {}
+
+    ## Record a changed file
+    #
+    # @param self The object pointer
+    # @param path path relative to the repo root
+    # @param commit SHA of the commit changing the file
+    # @param blob SHA of the file content after the commit, None if deleted
+    def add(self, path, commit, blob = None):
+        self.paths.setdefault(path, {})[commit] = blob
+        self.by_commit.setdefault(commit, []).append((path, blob))
+
+    ## Get the commits which changed a file
+    #
+    # @param self The object pointer
+    # @param path path relative to the repo root
+    # @returns set of commit SHAs
+    def commits(self, path):
+        return set(self.paths.get(path, ()))
+
+    ## Get all commits which changed files matching any of the patterns
+    #
+    # The result is cached per set of patterns, so per ref checks can share it.
+    #
+    # @param self The object pointer
+    # @param patterns list of glob patterns
+    # @returns frozenset of commit SHAs
+    def commits_matching(self, patterns):
+        key = tuple(patterns)
+        if key not in self._commits_matching:
+            commits = set()
+            for path in self.matching(patterns):
+                commits.update(self.paths[path])
+            self._commits_matching[key] = frozenset(commits)
+        return self._commits_matching[key]
+
+    ## Get the changed files matching any of the patterns
+    #
+    # Patterns without a '/' are matched against the file name only.
+    #
+    # @param self The object pointer
+    # @param patterns list of glob patterns, e.g. *.cc or doc/*
+    # @returns list of paths
+    def matching(self, patterns):
+        match = _pattern_matcher(patterns)
+        return [path for path in self.paths if match(path)]
+
+    ## Check if all changed files match any of the patterns
+    #
+    # @param self The object pointer
+    # @param patterns list of glob patterns
+    # @returns True if no other files were changed
+    def only(self, patterns):
+        return len(self.matching(patterns)) == len(self.paths)
+
+    def __contains__(self, path):
+        return path in self.paths
+
+    def __iter__(self):
+        return iter(self.paths)
+
+    def __len__(self):
+        return len(self.paths)
+
+
+## Overall result of all per ref tasks of a push
+#
+# The push passes if every task passed for every ref.
+class PushVerdict(namedtuple('PushVerdict', ['passed', 'results'])):
+
+    ## Get the results of one task
+    #
+    # @param self The object pointer
+    # @param task task function
+    # @returns list of RefResult namedtuples in the order of the pushed refs
+    def of_task(self, task):
+        return [result for result in self.results if result.task == task.__name__]
+
+    ## Get the messages of all failed tasks
+    #
+    # @param self The object pointer
+    # @returns list of strings
+    def failures(self):
+        return ['%s (%s): %s' % (result.commit.remote_ref, result.task, result.message)
+                for result in self.results if not result.passed]
+
+
+## Per ref task deciding if the documentation of a pushed branch changed
+#
+# The value of the result is True if the branch is no veto branch and its
+# new commits change files documented by doxygen. Branches without new
+# commits, e.g. new branches on known commits, are published as well.
+#
+# @param controller GitHookController object
+# @param push Push namedtuple
+# @param commit Commit namedtuple of the ref
+# @returns tuple (passed, message, value)
+def ref_needs_docs(controller, push, commit):
+    branch = commit.local_branch
+    if (commit.local_ref == '(delete)' or not commit.local_ref.startswith('refs/heads/')
+            or branch in controller.vetobranches):
+        return True, '', False
+    if push.new_commits.empty(commit.remote_ref):
+        return True, '', True
+    doc_commits = push.changed_files.commits_matching(controller.doxy_patterns)
+    return True, '', push.new_commits.reaches(commit.remote_ref, doc_commits)
+
+
+## Per ref task listing changed files without a passing lint verdict
+#
+# Files linted by the pre-commit hook have a verdict for their content in
+# the ledger. The value of the result lists (path, blob, commit) tuples of
+# the new commits of the ref which still need to be linted, e.g. for commits made
+# by a rebase or fetched from others. Commits contained in several refs
+# are only listed for the first of them, see NewCommits.owned().
+#
+# @param controller GitHookController object
+# @param push Push namedtuple
+# @param commit Commit namedtuple of the ref
+# @returns tuple (passed, message, value)
+def ref_unverified_lint(controller, push, commit):
+    unverified = []
+    for sha in push.new_commits.owned(commit.remote_ref):
+        for path, blob in push.changed_files.by_commit.get(sha, ()):
+            if blob is None or not controller.linters.lookup(path):
+                continue
+            if controller.verdicts.lookup('lint', controller.lint_config_hash(path), blob) != 'pass':
+                unverified.append((path, blob, sha))
+    return True, '', unverified
+
+
+## Append-only store of check results keyed by git object
+#
+# Every line records check id, config hash, object SHA, result and time,
+# separated by tabs. Later lines override earlier ones for the same key.
+# The file is rewritten without superseded and expired entries once it
+# holds much more lines than entries, and only the newest max_entries
+# entries are kept. Writers are serialized by a lock file.
+class VerdictLedger(object):
+
+    ## The constructor.
+    #
+    # @param self The object pointer
+    # @param path path of the ledger file
+    # @param max_entries maximum number of entries kept by compaction
+    # @param max_age seconds after which an entry is evicted
+    def __init__(self, path, max_entries = 50000, max_age = 90 * 86400):
+        self.path = path
+        self.max_entries = max_entries
+        self.max_age = max_age
+        self._entries = None
+        self._lines = 0
+
+    ## Entries of the ledger, loaded on first use
+    #
+    # @param self The object pointer
+    # @returns dict mapping (check, config_hash, sha) to (result, time)
+    @property
+    def entries(self):
+        if self._entries is None:
+            self._entries, self._lines = self._read()
+        return self._entries
+
+    ## Read all entries from the ledger file
+    #
+    # Incomplete lines, e.g. from an interrupted write, are skipped.
+    #
+    # @param self The object pointer
+    # @returns tuple of the entries dict and the number of lines
+    def _read(self):
+        entries = {}
+        lines = 0
+        if not os.path.exists(self.path):
+            return entries, lines
+        with open(self.path) as ledger:
+            for line in ledger:
+                lines += 1
+                fields = line.rstrip('\n').split('\t')
+                if len(fields) != 5 or not line.endswith('\n'):
+                    continue
+                try:
+                    entries[tuple(fields[:3])] = (fields[3], float(fields[4]))
+                except ValueError:
+                    continue
+        return entries, lines
+
+    ## Get the result of a check for an object
+    #
+    # @param self The object pointer
+    # @param check id of the check, e.g. 'lint'
+    # @param config_hash hash of the configuration the check ran with
+    # @param sha SHA of the checked blob or tree
+    # @returns the recorded result or None
+    def lookup(self, check, config_hash, sha):
+        entry = self.entries.get((check, config_hash, sha))
+        if entry is None or entry[1] < time.time() - self.max_age:
+            return None
+        return entry[0]
+
+    ## Record check results
+    #
+    # @param self The object pointer
+    # @param verdicts iterable of (check, config_hash, sha, result) tuples
+    def record(self, verdicts):
+        now = time.time()
+        lines = []
+        for check, config_hash, sha, result in verdicts:
+            self.entries[(check, config_hash, sha)] = (result, now)
+            lines.append('%s\t%s\t%s\t%s\t%.0f\n' % (check, config_hash, sha, result, now))
+        if not lines:
+            return
+        with self._locked():
+            with open(self.path, 'a') as ledger:
+                ledger.write(''.join(lines))
+        self._lines += len(lines)
+        # some slack above max_entries, so not every new entry compacts
+        if (self._lines > 2 * max(len(self.entries), 1000)
+                or len(self.entries) > self.max_entries + self.max_entries // 4):
+            self.compact()
+
+    ## Rewrite the ledger without superseded, expired and excess entries
+    #
+    # @param self The object pointer
+    def compact(self):
+        with self._locked():
+            # other hooks may have appended since the ledger was loaded
+            entries, lines = self._read()
+            oldest = time.time() - self.max_age
+            kept = sorted((item for item in entries.items() if item[1][1] >= oldest),
+                          key = lambda item: item[1][1])[-self.max_entries:]
+            temp_path = self.path + '.tmp'
+            with open(temp_path, 'w') as ledger:
+                for (check, config_hash, sha), (result, recorded) in kept:
+                    ledger.write('%s\t%s\t%s\t%s\t%.0f\n' % (check, config_hash, sha, result, recorded))
+            os.rename(temp_path, self.path)
+        self._entries = dict(kept)
+        self._lines = len(kept)
+
+    ## Context manager holding the lock of the ledger
+    #
+    # @param self The object pointer
+    # @returns context manager
+    @contextlib.contextmanager
+    def _locked(self):
+        directory = os.path.dirname(self.path)
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        with open(self.path + '.lock', 'a') as lockfile:
+            fcntl.flock(lockfile, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lockfile, fcntl.LOCK_UN)
+
+
+## File based queue of background doxygen builds
+#
+# The state is kept as JSON in <directory>/queue.json and holds the
+# pending jobs, at most one per branch, the running job and the result of
+# the last build per branch. A new job for a branch replaces its pending
+# job, so several quick commits lead to one build. All state changes are
+# serialized by a lock file. The worker holds worker.lock while it runs,
+# so at most one worker builds the documentation of a repo.
+class DoxygenQueue(object):
+
+    ## The constructor.
+    #
+    # @param self The object pointer
+    # @param directory directory of the queue files
+    def __init__(self, directory):
+        self.directory = directory
+        self.path = os.path.join(directory, 'queue.json')
+        self.log_path = os.path.join(directory, 'worker.log')
+        self._worker_lock = None
+
+    ## Add a build job for a branch, replacing its pending job
+    #
+    # @param self The object pointer
+    # @param branch name of the branch
+    # @param commit SHA of the commit the build is triggered by
+    # @returns True if a pending job of the branch was replaced
+    def enqueue(self, branch, commit):
+        with self._locked() as state:
+            coalesced = branch in state['pending']
+            queued = state['pending'].get(branch, {}).get('queued', time.time())
+            state['pending'][branch] = {'commit': commit, 'queued': queued}
+        return coalesced
+
+    ## Take the oldest pending job and mark it as running
+    #
+    # @param self The object pointer
+    # @param on_empty function called while the lock is held if no job is left
+    # @returns dict with branch and commit or None
+    def take(self, on_empty = None):
+        with self._locked() as state:
+            state['running'] = None
+            if not state['pending']:
+                if on_empty is not None:
+                    on_empty()
+                return None
+            branch = min(state['pending'], key = lambda name: state['pending'][name]['queued'])
+            job = state['pending'].pop(branch)
+            job.update({'branch': branch, 'pid': os.getpid(), 'started': time.time()})
+            state['running'] = job
+            return dict(job)
+
+    ## Store the result of a finished job
+    #
+    # @param self The object pointer
+    # @param job dict as returned by take
+    # @param status result of the build, e.g. 'ok' or 'failed'
+    # @param warnings number of doxygen warnings
+    def finish(self, job, status, warnings = None):
+        with self._locked() as state:
+            state['running'] = None
+            state['done'][job['branch']] = {'commit': job['commit'],
+                                            'status': status,
+                                            'warnings': warnings,
+                                            'finished': time.time(),
+                                            'duration': time.time() - job['started']}
+
+    ## Get a copy of the queue state
+    #
+    # @param self The object pointer
+    # @returns dict with keys pending, running and done
+    def state(self):
+        with self._locked() as state:
+            return json.loads(json.dumps(state))
+
+    ## Check if jobs of branches are pending or running
+    #
+    # @param self The object pointer
+    # @param branches branch names or None for all branches
+    # @returns True if work is left
+    def busy(self, branches = None):
+        state = self.state()
+        names = set(state['pending'])
+        if state['running'] is not None:
+            names.add(state['running']['branch'])
+        if branches is not None:
+            names &= set(branches)
+        return bool(names)
+
+    ## Check if a worker process is active
+    #
+    # @param self The object pointer
+    # @returns True if another process holds the worker lock
+    def worker_alive(self):
+        if self._worker_lock is not None:
+            return True
+        self._makedirs()
+        with open(os.path.join(self.directory, 'worker.lock'), 'a') as lockfile:
+            try:
+                fcntl.flock(lockfile, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except IOError:
+                return True
+            fcntl.flock(lockfile, fcntl.LOCK_UN)
+        return False
+
+    ## Become the worker of the queue
+    #
+    # @param self The object pointer
+    # @returns False if another worker is active
+    def acquire_worker(self):
+        self._makedirs()
+        lockfile = open(os.path.join(self.directory, 'worker.lock'), 'a')
+        try:
+            fcntl.flock(lockfile, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except IOError:
+            lockfile.close()
+            return False
+        self._worker_lock = lockfile
+        return True
+
+    ## Give up the worker role
+    #
+    # @param self The object pointer
+    def release_worker(self):
+        if self._worker_lock is not None:
+            fcntl.flock(self._worker_lock, fcntl.LOCK_UN)
+            self._worker_lock.close()
+            self._worker_lock = None
+
+    ## Create the queue directory if needed
+    #
+    # @param self The object pointer
+    def _makedirs(self):
+        if not os.path.isdir(self.directory):
+            os.makedirs(self.directory)
+
+    ## Context manager holding the lock and yielding the mutable state
+    #
+    # The state is written back when the block is left.
+    #
+    # @param self The object pointer
+    # @returns context manager
+    @contextlib.contextmanager
+    def _locked(self):
+        self._makedirs()
+        with open(self.path + '.lock', 'a') as lockfile:
+            fcntl.flock(lockfile, fcntl.LOCK_EX)
+            try:
+                state = _read_json(self.path) or {}
+                state.setdefault('pending', {})
+                state.setdefault('running', None)
+                state.setdefault('done', {})
+                before = json.dumps(state, sort_keys = True)
+                yield state
+                if json.dumps(state, sort_keys = True) != before:
+                    temp_path = self.path + '.tmp'
+                    _write_json(temp_path, state)
+                    os.rename(temp_path, self.path)
+            finally:
+                fcntl.flock(lockfile, fcntl.LOCK_UN)
+
+
+## Doxygen warnings accepted for a branch
+#
+# Stored as one line per distinct warning with its key and how often it
+# occurs, see _doxygen_warning_key. Warnings in a build are new if their
+# key is not in the baseline or occurs more often than accepted.
+class DoxygenBaseline(object):
+
+    ## The constructor.
+    #
+    # @param self The object pointer
+    # @param path path of the baseline file
+    def __init__(self, path):
+        self.path = path
+        self.counts = {}
+        if os.path.exists(path):
+            with open(path) as baseline:
+                for line in baseline:
+                    key, count = line.split()
+                    self.counts[key.decode('hex')] = int(count)
+
+    ## Check if a baseline was stored
+    #
+    # @param self The object pointer
+    # @returns True if the baseline file exists
+    @property
+    def exists(self):
+        return os.path.exists(self.path)
+
+    ## Compare warnings with the baseline
+    #
+    # @param self The object pointer
+    # @param warnings iterable of DoxygenWarning namedtuples
+    # @param max_shown maximum number of new warnings returned
+    # @param scope function telling if a warning counts, None to count all warnings
+    # @returns DoxygenCheck namedtuple
+    def compare(self, warnings, max_shown = 50, scope = None):
+        remaining = dict(self.counts)
+        counts = {}
+        total = nnew = 0
+        new = []
+        for warning in warnings:
+            total += 1
+            key = _doxygen_warning_key(warning)
+            counts[key] = counts.get(key, 0) + 1
+            if remaining.get(key, 0) > 0:
+                remaining[key] -= 1
+                continue
+            if scope is not None and not scope(warning):
+                continue
+            nnew += 1
+            if len(new) < max_shown:
+                new.append(warning)
+        return DoxygenCheck(total, nnew, new, counts)
+
+    ## Store warnings as the new baseline
+    #
+    # @param self The object pointer
+    # @param counts dict of warning key and count, see DoxygenCheck.counts
+    def save(self, counts):
+        directory = os.path.dirname(self.path)
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        _write_if_changed(self.path, ''.join('%s %d\n' % (key.encode('hex'), count)
+                                             for key, count in sorted(counts.items())))
+        self.counts = dict(counts)
+
+
+## Content addressed store of doxygen output files shared by all branches
+#
+# Identical output files of the doc_<branch> folders are hardlinks to one
+# object named by the sha1 of its content. Objects without other links
+# are not used by any folder anymore and are removed by gc. Doxygen writes
+# into existing files, so links have to be broken before a folder is
+# built again, see break_links.
+class DocObjectStore(object):
+
+    ## The constructor.
+    #
+    # @param self The object pointer
+    # @param path directory of the objects, on the same file system as the output
+    def __init__(self, path):
+        self.path = path
+
+    ## Remove the linked files of a folder before doxygen writes into it
+    #
+    # Doxygen creates all files of a build again, so unlinking is enough.
+    #
+    # @param directory output folder
+    # @returns number of removed links
+    @staticmethod
+    def break_links(directory):
+        nlinks = 0
+        for path in DocObjectStore._files(directory):
+            if os.lstat(path).st_nlink > 1:
+                os.unlink(path)
+                nlinks += 1
+        return nlinks
+
+    ## Replace the files of a folder with links to identical objects
+    #
+    # Files which are not linked yet become new objects if their content
+    # is unknown.
+    #
+    # @param self The object pointer
+    # @param directory output folder
+    # @returns tuple of number of files, number of linked files and saved bytes
+    def dedup(self, directory):
+        nfiles = nlinked = saved = 0
+        for path in self._files(directory):
+            nfiles += 1
+            stat = os.lstat(path)
+            if stat.st_nlink > 1:
+                continue
+            digest = _file_digest(path)
+            obj = os.path.join(self.path, digest[:2], digest[2:])
+            try:
+                os.link(path, obj)
+                continue
+            except OSError, e:
+                if e.errno == errno.ENOENT and not os.path.isdir(os.path.dirname(obj)):
+                    os.makedirs(os.path.dirname(obj))
+                    os.link(path, obj)
+                    continue
+                if e.errno != errno.EEXIST:
+                    raise
+            temp_path = path + '.dedup'
+            try:
+                os.link(obj, temp_path)
+            except OSError, e:
+                # removed by a concurrent gc
+                if e.errno != errno.ENOENT:
+                    raise
+                continue
+            os.rename(temp_path, path)
+            nlinked += 1
+            saved += stat.st_size
+        return nfiles, nlinked, saved
+
+    ## Remove objects which are not linked from any folder
+    #
+    # @param self The object pointer
+    # @returns tuple of number of removed objects and freed bytes
+    def gc(self):
+        nobjects = freed = 0
+        for path in self._files(self.path):
+            stat = os.lstat(path)
+            if stat.st_nlink == 1:
+                os.unlink(path)
+                nobjects += 1
+                freed += stat.st_size
+        return nobjects, freed
+
+    ## Get the regular files below a directory
+    #
+    # The build stamp and warning copies are left out, they are written in place.
+    #
+    # @param directory directory to walk
+    # @returns generator of paths
+    @staticmethod
+    def _files(directory):
+        for dirpath, dirnames, filenames in os.walk(directory):
+            for filename in filenames:
+                if filename.startswith(DOXYGEN_PRIVATE_PREFIX):
+                    continue
+                path = os.path.join(dirpath, filename)
+                if not os.path.islink(path):
+                    yield path
+
+
+## Doc template compiled into literal and placeholder segments
+#
+# Supported placeholders are %token% (doxy_cfg_template), ++token++ and
+# +++token+++ (header and footer templates). Rendering joins the segments
+# in one pass, so the size of the template is copied once, not once per
+# token. Placeholders without a value are kept as they are and reported
+# once per template, with the closest known token as suggestion.
+class DocTemplate(object):
+
+    ## Compiled templates by file identity
+    _cache = {}
+
+    ## The constructor.
+    #
+    # @param self The object pointer
+    # @param text template text
+    # @param name name of the template used in warnings
+    def __init__(self, text, name = '<string>'):
+        self.name = name
+        self.segments = []
+        pos = 0
+        for match in TEMPLATE_TOKEN.finditer(text):
+            self.segments.append((text[pos:match.start()], match.group(0)))
+            pos = match.end()
+        self.segments.append((text[pos:], None))
+        self.tokens = set(token for literal, token in self.segments if token is not None)
+        self._reported = set()
+
+    ## Get the compiled template of a file
+    #
+    # Templates are compiled again if path, mtime, size or inode of the file change.
+    #
+    # @param cls The class
+    # @param path path of the template file
+    # @returns DocTemplate object
+    @classmethod
+    def load(cls, path):
+        stat = os.stat(path)
+        key = (os.path.abspath(path), stat.st_mtime, stat.st_size, stat.st_ino)
+        template = cls._cache.get(key)
+        if template is None:
+            with open(path, 'rU') as template_file:
+                template = cls(template_file.read(), path)
+            cls._cache[key] = template
+        return template
+
+    ## Render the template
+    #
+    # @param self The object pointer
+    # @param values dict of placeholder, e.g. '%output_dir%', and replacement
+    # @returns rendered text
+    def render(self, values):
+        unknown = self.tokens.difference(values).difference(self._reported)
+        if unknown:
+            self._report(unknown, values)
+        parts = []
+        for literal, token in self.segments:
+            parts.append(literal)
+            if token is not None:
+                parts.append(values.get(token, token))
+        return ''.join(parts)
+
+    ## Warn about placeholders without a value
+    #
+    # @param self The object pointer
+    # @param unknown set of placeholders
+    # @param values dict of known placeholders
+    def _report(self, unknown, values):
+        known = dict((TEMPLATE_TOKEN.match(token).group(0).strip('%+'), token) for token in values)
+        for token in sorted(unknown):
+            matches = difflib.get_close_matches(token.strip('%+'), known.keys(), 1, 0.5)
+            hint = ', did you mean %s?' % known[matches[0]] if matches else ''
+            log.warning('Unknown token %s in %s%s' % (token, self.name, hint))
+        self._reported.update(unknown)
+
+
+## Build a function matching paths against glob patterns
+#
+# Like in the LinterRegistry, '*.ext' patterns are looked up by extension
+# and patterns without a '/' are matched against the file name only.
+#
+# @param patterns list of glob patterns
+# @returns function taking a path and returning True if any pattern matches
+def _pattern_matcher(patterns):
+    extensions = set()
+    globs = []
+    for pattern in patterns:
+        extension = pattern[1:] if pattern.startswith('*.') else None
+        if extension and not any(c in extension for c in '*?[/'):
+            extensions.add(extension)
+        else:
+            globs.append((re.compile(fnmatch.translate(pattern)), '/' in pattern))
+
+    def match(path):
+        filename = path.rsplit('/', 1)[-1]
+        if os.path.splitext(filename)[1] in extensions:
+            return True
+        return any(regex.match(path if full_path else filename) for regex, full_path in globs)
+    return match
+
+
+## Collect the files changed by a set of commits
+#
+# Runs a single 'git diff-tree --stdin -r -z' for all commits. Each commit
+# is compared to its first parent, root commits to the empty tree.
+#
+# @param parents dict mapping commit SHAs to lists of parent SHAs
+# @returns ChangedFiles object
+def _changed_files_of_commits(parents):
+    changed = ChangedFiles()
+    if not parents:
+        return changed
+    cmd = ['git', 'diff-tree', '--stdin', '-r', '-z', '--root', '--no-renames']
+    proc = subprocess.Popen(cmd, stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+    # feed the commits from a thread, git starts writing before all are read
+    lines = ''.join('%s\n' % ' '.join([sha] + shas[:1]) for sha, shas in parents.items())
+    feeder = threading.Thread(target=_write_and_close, args=(proc.stdin, lines))
+    feeder.start()
+    fields = _iter_nul_fields(proc.stdout)
+    commit = None
+    for field in fields:
+        if field.startswith(':'):
+            # :old_mode new_mode old_blob new_blob status
+            meta = field.split()
+            blob = None if meta[4] == 'D' else meta[3]
+            changed.add(next(fields), commit, blob)
+        else:
+            commit = field.strip()
+    feeder.join()
+    proc.wait()
+    return changed
+
+
+## Read the content of blobs with a single git cat-file process
+#
+# @param items iterable of (key, blob SHA) tuples
+# @returns generator of (key, content) tuples
+def _read_blobs(items):
+    items = list(items)
+    proc = subprocess.Popen(['git', 'cat-file', '--batch'],
+                            stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+    feeder = threading.Thread(target=_write_and_close,
+                              args=(proc.stdin, ''.join('%s\n' % blob for key, blob in items)))
+    feeder.start()
+    try:
+        for key, blob in items:
+            header = proc.stdout.readline().split()
+            if len(header) != 3:
+                continue
+            content = proc.stdout.read(int(header[2]))
+            proc.stdout.read(1)
+            yield key, content
+    finally:
+        feeder.join()
+        proc.stdout.close()
+        proc.wait()
+
+
+## Get the values of a tag in a doxygen config file
+#
+# Handles line continuations and '+=' assignments.
+#
+# @param path path of the doxygen config file
+# @param tag name of the tag, e.g. INPUT
+# @returns list of values
+def _doxygen_cfg_values(path, tag):
+    values = []
+    if not os.path.exists(path):
+        return values
+    with open(path) as config:
+        text = config.read().replace('\\\n', ' ')
+    for line in text.splitlines():
+        if line.lstrip().startswith('#'):
+            continue
+        match = re.match(r'^\s*%s\s*(\+?=)(.*)$' % tag, line)
+        if match is None:
+            continue
+        if match.group(1) == '=':
+            values = []
+        try:
+            values.extend(shlex.split(match.group(2)))
+        except ValueError:
+            values.extend(match.group(2).split())
+    return values
+
+
+## Parse a doxygen warning log
+#
+# Reads the log line by line and yields one DoxygenWarning per warning.
+# Indented lines following a warning, e.g. lists of undocumented
+# parameters, are added to its message. Repeated warnings are yielded only
+# once; only their digests are kept in memory.
+#
+# @param stream file like object of the warning log
+# @param root paths below this directory are made relative to it
+# @returns generator of DoxygenWarning namedtuples
+def _iter_doxygen_warnings(stream, root = None):
+    prefix = os.path.join(os.path.abspath(root), '') if root is not None else None
+    seen = set()
+    current = None
+    for line in itertools.chain(stream, [None]):
+        if line is not None:
+            line = line.rstrip('\r\n')
+            if not line.strip():
+                continue
+            if current is not None and line[:1].isspace():
+                current[3].append(line.strip())
+                continue
+        if current is not None:
+            warning = DoxygenWarning(current[0], current[1], current[2], '\n'.join(current[3]))
+            key = hashlib.sha1(repr(tuple(warning))).digest()
+            if key not in seen:
+                seen.add(key)
+                yield warning
+        if line is None:
+            break
+        match = DOXYGEN_WARNING_LINE.match(line)
+        if match is not None:
+            path = match.group('path')
+            if prefix is not None and path.startswith(prefix):
+                path = path[len(prefix):]
+            current = [path, int(match.group('line')), match.group('kind') or 'warning',
+                       [match.group('message').strip()]]
+        else:
+            match = DOXYGEN_WARNING_KIND.match(line)
+            kind = match.group(1) if match is not None else 'warning'
+            current = ['', 0, kind, [line[match.end():].strip() if match is not None else line.strip()]]
+
+
+## Key of a doxygen warning in the baseline
+#
+# Line numbers are left out, so warnings stay known if code above them moves.
+#
+# @param warning DoxygenWarning namedtuple
+# @returns binary digest
+def _doxygen_warning_key(warning):
+    return hashlib.sha1('%s\0%s\0%s' % (warning.path, warning.kind, warning.message)).digest()
+
+
+## Format a doxygen warning like doxygen does
+#
+# @param warning DoxygenWarning namedtuple
+# @returns string
+def _format_doxygen_warning(warning):
+    return '%s:%d: %s: %s' % (warning.path, warning.line, warning.kind, warning.message)
+
+
+## Copy a doxygen warning log with paths relative to a directory
+#
+# @param src path of the warning log
+# @param dst path of the copy
+# @param root directory the paths are made relative to
+def _copy_doxygen_warnings(src, dst, root):
+    prefix = os.path.join(os.path.abspath(root), '')
+    with open(src) as source:
+        with open(dst, 'w') as copy:
+            for line in source:
+                copy.write(line[len(prefix):] if line.startswith(prefix) else line)
+
+
+## Get the name of the documentation folder of a branch
+#
+# The folders of all branches of a repo are next to each other, so a
+# branch like feature/x gets the flat folder doc_feature__x.
+#
+# @param branch branch name
+# @returns folder name
+def _doc_folder(branch):
+    return 'doc_%s' % branch.replace('/', '__')
+
+
+## Run a git command and get its output
+#
+# @param cmd command list
+# @param cwd directory the command runs in, another repo than the one of the hook
+# @returns stripped output or None if the command failed
+def _git_output(cmd, cwd = None):
+    env = None if cwd is None else _git_env()
+    proc = subprocess.Popen(cmd, cwd = cwd, env = env, stdout = subprocess.PIPE, stderr = subprocess.PIPE)
+    stdout = proc.communicate()[0].strip()
+    return stdout if proc.returncode == 0 and stdout else None
+
+
+## Get the environment for git commands in another repo or working tree
+#
+# Hooks get variables like GIT_INDEX_FILE pointing to the repo of the
+# hook. Git would use them in any other working tree as well, e.g. write
+# the index of a temporary worktree to the index of the repo.
+#
+# @returns copy of os.environ without these variables
+def _git_env():
+    env = dict(os.environ)
+    for name in GIT_REPO_ENV:
+        env.pop(name, None)
+    return env
+
+
+## Quote a path for git fast-import if needed
+#
+# @param path path of the file
+# @returns path as accepted in fast-import commands
+def _fast_import_path(path):
+    if path.startswith('"') or '\n' in path or '\\' in path:
+        return '"%s"' % path.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+    return path
+
+
+## Check if two files have the same content
+#
+# @param path first file
+# @param other second file
+# @returns True if both files exist and are equal
+def _same_content(path, other):
+    try:
+        if os.path.islink(other) or os.path.getsize(path) != os.path.getsize(other):
+            return False
+        with open(path, 'rb') as first:
+            with open(other, 'rb') as second:
+                while True:
+                    chunk = first.read(1 << 16)
+                    if chunk != second.read(1 << 16):
+                        return False
+                    if not chunk:
+                        return True
+    except (IOError, OSError):
+        return False
+
+
+## Update a directory to the content of another one
+#
+# Only new and changed files are copied, each to a temporary file which
+# is renamed over the old one. Files and folders which are not in src are
+# removed, except the build stamp and warning copies on the top level.
+#
+# @param src directory with the new content
+# @param dst directory to update
+# @param changed list the paths of written and removed files relative to dst are appended to, or None
+# @returns tuple of number of files, number of written files and written bytes
+def _sync_directory(src, dst, changed = None):
+    def removed(path):
+        if changed is None:
+            return
+        if os.path.isdir(path) and not os.path.islink(path):
+            for dirpath, dirnames, filenames in os.walk(path):
+                changed.extend(os.path.relpath(os.path.join(dirpath, name), dst) for name in filenames)
+        else:
+            changed.append(os.path.relpath(path, dst))
+
+    nfiles = nwritten = nbytes = 0
+    keep = set(['.'])
+    for dirpath, dirnames, filenames in os.walk(src):
+        relpath = os.path.relpath(dirpath, src)
+        target_dir = os.path.normpath(os.path.join(dst, relpath))
+        if not os.path.isdir(target_dir):
+            if os.path.lexists(target_dir):
+                removed(target_dir)
+                os.unlink(target_dir)
+            os.makedirs(target_dir)
+        for name in dirnames:
+            keep.add(os.path.normpath(os.path.join(relpath, name)))
+        for name in filenames:
+            keep.add(os.path.normpath(os.path.join(relpath, name)))
+            source = os.path.join(dirpath, name)
+            target = os.path.join(target_dir, name)
+            nfiles += 1
+            if _same_content(source, target):
+                continue
+            if os.path.isdir(target) and not os.path.islink(target):
+                removed(target)
+                shutil.rmtree(target)
+            temp_path = target + '.sync'
+            shutil.copy2(source, temp_path)
+            os.rename(temp_path, target)
+            if changed is not None:
+                changed.append(os.path.relpath(target, dst))
+            nwritten += 1
+            nbytes += os.path.getsize(target)
+    for dirpath, dirnames, filenames in os.walk(dst, topdown = False):
+        relpath = os.path.relpath(dirpath, dst)
+        for name in filenames:
+            if relpath == '.' and name.startswith('.doxygen_'):
+                continue
+            if os.path.normpath(os.path.join(relpath, name)) not in keep:
+                removed(os.path.join(dirpath, name))
+                os.unlink(os.path.join(dirpath, name))
+        for name in dirnames:
+            if os.path.normpath(os.path.join(relpath, name)) not in keep:
+                path = os.path.join(dirpath, name)
+                removed(path)
+                if os.path.islink(path):
+                    os.unlink(path)
+                else:
+                    shutil.rmtree(path, ignore_errors = True)
+    return nfiles, nwritten, nbytes
+
+
+## Replace a directory with a copy of another one
+#
+# The copy is made next to dst and renamed into place, so readers see
+# either the old or the complete new content.
+#
+# @param src directory with the new content
+# @param dst directory to replace
+# @returns tuple of number of files, number of written files and written bytes
+def _swap_directory(src, dst):
+    new_path = dst + '.new'
+    old_path = dst + '.old'
+    for path in (new_path, old_path):
+        if os.path.lexists(path):
+            shutil.rmtree(path)
+    shutil.copytree(src, new_path, symlinks = True)
+    nfiles = nbytes = 0
+    for dirpath, dirnames, filenames in os.walk(new_path):
+        for name in filenames:
+            nfiles += 1
+            nbytes += os.path.getsize(os.path.join(dirpath, name))
+    if os.path.isdir(dst):
+        os.rename(dst, old_path)
+    os.rename(new_path, dst)
+    shutil.rmtree(old_path, ignore_errors = True)
+    return nfiles, nfiles, nbytes
+
+
+## Get the sha1 hex digest of a file
+#
+# @param path path of the file
+# @returns hex digest or None if the file does not exist
+def _file_digest(path):
+    if not os.path.isfile(path):
+        return None
+    digest = hashlib.sha1()
+    with open(path, 'rb') as data:
+        for chunk in iter(lambda: data.read(1 << 20), ''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+## Hash a doxygen config without the settings that differ between builds
+#
+# Pre-commit and push builds write the config to different directories
+# and give doxygen different numbers of threads. The header and footer
+# paths and the thread settings are left out, so both builds share their
+# stamps. The content of header and footer is hashed separately.
+#
+# @param path path of the doxygen config
+# @returns hex digest or None if the file does not exist
+def _doxygen_cfg_digest(path):
+    if not os.path.isfile(path):
+        return None
+    digest = hashlib.sha1()
+    with open(path, 'rb') as config:
+        for line in config:
+            if not DOXYGEN_UNSTAMPED_TAGS.match(line):
+                digest.update(line)
+    return digest.hexdigest()
+
+
+## Write a file only if its content changed
+#
+# The content is compared by hash with the existing file, a changed file is
+# written to a temporary file next to it and renamed, so readers never see
+# a partially written file and unchanged files keep their mtime.
+#
+# @param path path of the file
+# @param text new content
+# @returns True if the file was rewritten, False if it was reused
+def _write_if_changed(path, text):
+    if _file_digest(path) == hashlib.sha1(text).hexdigest():
+        return False
+    fd, temp_path = tempfile.mkstemp(prefix = '.' + os.path.basename(path) + '.',
+                                     dir = os.path.dirname(os.path.abspath(path)))
+    try:
+        with os.fdopen(fd, 'wb') as newfile:
+            newfile.write(text)
+        if os.path.exists(path):
+            os.chmod(temp_path, os.stat(path).st_mode & 0777)
+        else:
+            os.chmod(temp_path, 0666 & ~_umask())
+        os.rename(temp_path, path)
+    except:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+    return True
+
+
+## Get the umask of the process
+#
+# @returns the umask
+def _umask():
+    mask = os.umask(0)
+    os.umask(mask)
+    return mask
+
+
+## Read a JSON file
+#
+# @param path path of the file
+# @returns the decoded content or None if the file is missing or broken
+def _read_json(path):
+    try:
+        with open(path) as jsonfile:
+            return json.load(jsonfile)
+    except (IOError, ValueError):
+        return None
+
+
+## Write a JSON file
+#
+# @param path path of the file
+# @param data JSON serializable data
+def _write_json(path, data):
+    with open(path, 'w') as jsonfile:
+        json.dump(data, jsonfile, indent = 1, sort_keys = True)
+
+
+## Write data to a pipe and close it
+#
+# @param pipe file object
+# @param data string to write
+def _write_and_close(pipe, data):
+    try:
+        pipe.write(data)
+    finally:
+        pipe.close()
+
+
+## Get the number of CPUs the process may run on
+#
+# Uses the CPU affinity (os.sched_getaffinity or Cpus_allowed_list in
+# /proc) and falls back to the number of CPUs of the machine.
+#
+# @returns number of CPUs
+def _available_cpus():
+    if hasattr(os, 'sched_getaffinity'):
+        return len(os.sched_getaffinity(0))
+    try:
+        with open('/proc/self/status') as status:
+            for line in status:
+                if line.startswith('Cpus_allowed_list:'):
+                    ncpus = 0
+                    for part in line.split(':', 1)[1].strip().split(','):
+                        first, _, last = part.partition('-')
+                        ncpus += int(last or first) - int(first) + 1
+                    return ncpus
+    except (IOError, ValueError):
+        pass
+    return multiprocessing.cpu_count()
+
+
+## Find an executable in PATH
+#
+# @param name name of the executable
+# @returns path of the executable or None
+def _which(name):
+    for directory in os.environ.get('PATH', '').split(os.pathsep):
+        path = os.path.join(directory, name)
+        if os.path.isfile(path) and os.access(path, os.X_OK):
+            return path
+    return None
+
+
+## Get the version of doxygen
+#
+# @returns tuple of ints, empty if doxygen is not available
+def _doxygen_version():
+    if not hasattr(_doxygen_version, 'version'):
+        try:
+            proc = subprocess.Popen(['doxygen', '--version'], stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+            output = proc.communicate()[0]
+        except OSError:
+            output = ''
+        _doxygen_version.version = tuple(int(part) for part in re.findall(r'\d+', output.split(' ')[0])[:3])
+    return _doxygen_version.version
+
+
+## Get the command line of a process
+#
+# Reads /proc/<pid>/cmdline on Linux and falls back to ps elsewhere. The ps
+# output is split like a shell would do it, which may differ from the real
+# arguments if they contained spaces.
+#
+# @param pid process id
+# @returns list of arguments
+def _process_argv(pid):
+    try:
+        with open('/proc/%d/cmdline' % pid, 'rb') as cmdline:
+            argv = cmdline.read().split('\0')
+        if argv and argv[-1] == '':
+            argv.pop()
+        return argv
+    except IOError:
+        pass
+    command = subprocess.Popen(['ps', '-ocommand=', '-p', str(pid)],
+                               stdout=subprocess.PIPE).communicate()[0]
+    try:
+        return shlex.split(command)
+    except ValueError:
+        return command.split()
+
+
+# git options which take the next argument as value
+GIT_OPTIONS_WITH_VALUE = ('-C', '-c', '--git-dir', '--work-tree', '--namespace')
+PUSH_OPTIONS_WITH_VALUE = ('--repo', '--receive-pack', '--exec', '--push-option')
+
+
+## Check if a git push command line forces the update of a ref
+#
+# Detects --force, -f (also inside combined short options like -uf),
+# --force-with-lease and refspecs prefixed with '+'.
+#
+# @param argv arguments of the git push process
+# @returns True if the push is forced
+def _is_forced_push(argv):
+    args = iter(argv[1:])
+    if not os.path.basename(argv[0] if argv else '').startswith('git-push'):
+        # skip global git options up to the push command
+        for arg in args:
+            if arg == 'push':
+                break
+            if arg in GIT_OPTIONS_WITH_VALUE:
+                next(args, None)
+        else:
+            return False
+    positional = []
+    for arg in args:
+        if arg == '--':
+            positional.extend(args)
+        elif arg.startswith('--'):
+            if arg == '--force' or arg.split('=', 1)[0] == '--force-with-lease':
+                return True
+            if arg in PUSH_OPTIONS_WITH_VALUE:
+                next(args, None)
+        elif arg.startswith('-') and len(arg) > 1:
+            for i, flag in enumerate(arg[1:]):
+                if flag == 'f':
+                    return True
+                if flag == 'o':
+                    # the rest of the argument or the next one is the push option
+                    if i == len(arg) - 2:
+                        next(args, None)
+                    break
+        else:
+            positional.append(arg)
+    # the first positional argument is the remote, the others are refspecs
+    return any(refspec.startswith('+') for refspec in positional[1:])
+
+
+## Parse one line of cpplint output
+#
+# @param line line of linter output
+# @returns LintFinding object or None if the line is no finding
+def _parse_cpplint_line(line):
+    match = CPPLINT_LINE.match(line)
+    if match is None:
+        return None
+    path, linenum, message, category, confidence = match.groups()
+    return LintFinding(path, int(linenum), category, int(confidence), message)
+
+
+## Parse one line of pep8 style output
+#
+# pep8 has no confidence levels, the error code is used as category.
+#
+# @param line line of linter output
+# @returns LintFinding object or None if the line is no finding
+def _parse_pep8_line(line):
+    match = PEP8_LINE.match(line)
+    if match is None:
+        return None
+    path, linenum, column, code, message = match.groups()
+    return LintFinding(path, int(linenum), code, None, message)
+
+# known linter output formats
+LINT_FORMATS = {'cpplint' : _parse_cpplint_line,
+                'pep8' : _parse_pep8_line}
 
 
 ## Decorator function to modify returncodes in case lint is not being enforced
@@ -65,16 +1706,584 @@ def enforce_dectorator(attribute):
     return _enforce_dectorator
 
 
+## Parse the hunks of a diff with zero context lines
+#
+# Only lines which exist in the new version of a file are recorded, pure
+# deletions are skipped. The diff needs the prefixes a/ and b/.
+#
+# @param stream file like object with the output of git diff -U0
+# @returns dict mapping file paths to LineIntervals of changed lines
+def _diff_line_ranges(stream):
+    ranges = {}
+    intervals = None
+    # number of hunk body lines left to skip in the current hunk
+    skip = 0
+    for line in stream:
+        if skip:
+            skip -= 1
+            continue
+        if line.startswith('@@'):
+            match = HUNK_HEADER.match(line)
+            if match is None:
+                continue
+            old_count, new_start, new_count = match.groups()
+            old_count = 1 if old_count is None else int(old_count)
+            new_count = 1 if new_count is None else int(new_count)
+            skip = old_count + new_count
+            if intervals is not None and new_count > 0:
+                new_start = int(new_start)
+                intervals.add(new_start, new_start + new_count - 1)
+        elif line.startswith('+++ '):
+            # git appends a tab to paths containing spaces
+            path = _unquote_git_path(line[4:].rstrip('\n').rstrip('\t'))
+            if path == '/dev/null':
+                intervals = None
+                continue
+            if path.startswith('b/'):
+                path = path[2:]
+            intervals = ranges.setdefault(path, LineIntervals())
+    return ranges
+
+
+## Compact set of line ranges for one file
+#
+# Ranges are stored as two parallel lists of inclusive start and end lines.
+# Hunks from git diff arrive in ascending order, so adding a range is usually
+# an append or a merge with the last range. Lookups use a binary search.
+class LineIntervals(object):
+    __slots__ = ('starts', 'ends', '_sorted')
+
+    ## The constructor.
+    #
+    # @param self The object pointer
+    def __init__(self):
+        self.starts = []
+        self.ends = []
+        self._sorted = True
+
+    ## Add an inclusive range of lines
+    #
+    # @param self The object pointer
+    # @param start first line of the range
+    # @param end last line of the range
+    def add(self, start, end):
+        if self.starts and start < self.starts[-1]:
+            self._sorted = False
+        if self._sorted and self.ends and start <= self.ends[-1] + 1:
+            if end > self.ends[-1]:
+                self.ends[-1] = end
+        else:
+            self.starts.append(start)
+            self.ends.append(end)
+
+    ## Sort and merge ranges which were added out of order
+    #
+    # @param self The object pointer
+    def _normalize(self):
+        ranges = sorted(zip(self.starts, self.ends))
+        self.starts, self.ends = [], []
+        self._sorted = True
+        for start, end in ranges:
+            self.add(start, end)
+
+    def __contains__(self, line):
+        if not self._sorted:
+            self._normalize()
+        index = bisect.bisect_right(self.starts, line) - 1
+        return index >= 0 and line <= self.ends[index]
+
+    def __len__(self):
+        return len(self.starts)
+
+    def __iter__(self):
+        if not self._sorted:
+            self._normalize()
+        return iter(zip(self.starts, self.ends))
+
+
+## An external linter which checks files matching a set of patterns
+#
+# Linters which accept several files per call are run in batches of up to
+# batch_size files. At most max_procs processes of one linter run at once.
+class Linter(object):
+
+    ## The constructor.
+    #
+    # @param self The object pointer
+    # @param name name of the linter
+    # @param command command line as list, the files are appended
+    # @param patterns list of extension globs (*.cc) or path globs (src/*.py)
+    # @param output_format key in LINT_FORMATS describing the linter output
+    # @param batch boolean, True if the linter accepts several files
+    # @param max_procs maximum number of concurrent processes of this linter
+    # @param batch_size maximum number of files passed in one call
+    # @param engine 'process' to run command or 'python' to import module in a worker pool
+    # @param module name of the python module used by the python engine
+    # @param args list of arguments passed to the python module
+    # @param path_sensitive boolean, True if the findings depend on the file path
+    def __init__(self, name, command, patterns, output_format = 'cpplint',
+                 batch = False, max_procs = 1, batch_size = 50,
+                 engine = 'process', module = None, args = (), path_sensitive = False):
+        self.name = name
+        self.command = command
+        self.patterns = patterns
+        self.output_format = output_format
+        self.batch = batch
+        self.max_procs = max(1, max_procs)
+        self.batch_size = max(1, batch_size)
+        self.engine = engine
+        self.module = module
+        self.args = list(args)
+        self.path_sensitive = path_sensitive
+        self._in_process = None
+
+    ## Whether the linter runs inside a pool of python worker processes
+    #
+    # Falls back to the command if the python module is not installed. A
+    # linter without a command then fails instead of running the files.
+    #
+    # @param self The object pointer
+    # @returns True if the python engine is used
+    @property
+    def in_process(self):
+        if self._in_process is None:
+            self._in_process = False
+            if self.engine == 'python':
+                if pkgutil.find_loader(self.module) is not None:
+                    self._in_process = True
+                elif self.command:
+                    log.warning('Python module %s not found, running %s instead' % (self.module, self.name))
+        return self._in_process
+
+    ## Split a list of files into calls of this linter
+    #
+    # Batches hold at most batch_size files and there are at least as many
+    # as max_procs, so all processes get work. Files are dealt round-robin,
+    # each batch gets large and small files and the first batches get the
+    # largest ones if the files are sorted by size.
+    #
+    # @param self The object pointer
+    # @param paths list of files to check
+    # @returns generator of (command, paths) tuples
+    def jobs(self, paths):
+        if not paths:
+            return
+        size = 1
+        if self.batch:
+            size = min(self.batch_size, -(-len(paths) // self.max_procs))
+        nbatches = -(-len(paths) // size)
+        for i in xrange(nbatches):
+            chunk = paths[i::nbatches]
+            yield self.command + chunk, chunk
+
+    ## Convert one line of linter output into a finding
+    #
+    # @param self The object pointer
+    # @param line line of linter output
+    # @returns LintFinding object or None if the line is no finding
+    def parse_finding(self, line):
+        return LINT_FORMATS[self.output_format](line.rstrip('\n'))
+
+    def __repr__(self):
+        return 'Linter(%s)' % self.name
+
+
+## Dispatch table from file paths to linters
+#
+# Patterns of the form '*.ext' are indexed by extension and resolved with a
+# single dict lookup, all other patterns are precompiled fnmatch expressions.
+# Patterns without a '/' are matched against the file name only.
+class LinterRegistry(object):
+
+    ## The constructor.
+    #
+    # @param self The object pointer
+    # @param linters list of Linter objects
+    def __init__(self, linters = ()):
+        self.linters = OrderedDict()
+        self._by_extension = {}
+        self._globs = []
+        for linter in linters:
+            self.add(linter)
+
+    ## Register a linter and index its patterns
+    #
+    # @param self The object pointer
+    # @param linter Linter object
+    def add(self, linter):
+        self.linters[linter.name] = linter
+        for pattern in linter.patterns:
+            extension = pattern[1:] if pattern.startswith('*.') else None
+            if extension and not any(c in extension for c in '*?[/'):
+                self._by_extension.setdefault(extension, []).append(linter)
+            else:
+                regex = re.compile(fnmatch.translate(pattern))
+                self._globs.append((regex, '/' in pattern, linter))
+
+    ## Get a registered linter by name
+    #
+    # @param self The object pointer
+    # @param name name of the linter
+    # @returns Linter object or None
+    def get(self, name):
+        return self.linters.get(name)
+
+    ## Find all linters responsible for a file
+    #
+    # @param self The object pointer
+    # @param path path of the file relative to the repo root
+    # @returns list of Linter objects
+    def lookup(self, path):
+        filename = path.rsplit('/', 1)[-1]
+        extension = os.path.splitext(filename)[1]
+        found = list(self._by_extension.get(extension, []))
+        for regex, full_path, linter in self._globs:
+            if linter in found:
+                continue
+            if regex.match(path if full_path else filename):
+                found.append(linter)
+        return found
+
+    ## Group files by the linters which have to check them
+    #
+    # @param self The object pointer
+    # @param paths iterable of file paths
+    # @returns OrderedDict mapping Linter objects to lists of paths
+    def dispatch(self, paths):
+        groups = OrderedDict()
+        for path in paths:
+            for linter in self.lookup(path):
+                groups.setdefault(linter, []).append(path)
+        return groups
+
+
+## Build the linter registry for a repo
+#
+# Each subsection of the linters section enables one linter. Options not
+# given in the config are taken from DEFAULT_LINTERS if the name is known.
+# A command given in the config replaces the builtin python engine unless
+# the engine is set as well, the python engine then takes its arguments
+# from the command if no args are given.
+#
+# @param section the [[[linters]]] config section of a repo or None
+# @returns LinterRegistry object
+def build_linter_registry(section = None):
+    if not section:
+        section = {'cpplint' : {}}
+    linters = []
+    for name in section:
+        options = dict(DEFAULT_LINTERS.get(name, {}))
+        options.update(section[name])
+        own_command = 'command' in section[name]
+        if own_command and 'engine' not in section[name] and options.get('engine') == 'python':
+            log.info('Linter %s runs the configured command instead of the python module' % name)
+            options['engine'] = 'process'
+        if 'command' not in options and 'module' not in options or 'patterns' not in options:
+            log.error('Linter %s needs at least a command or module and patterns, skipping it' % name)
+            continue
+        patterns = options['patterns']
+        if isinstance(patterns, basestring):
+            patterns = [patterns]
+        engine = options.get('engine', 'process' if 'command' in options else 'python')
+        args = shlex.split(options.get('args', ''))
+        if own_command and 'args' not in section[name]:
+            args = shlex.split(options['command'])[1:]
+        linters.append(Linter(name,
+                              shlex.split(options.get('command', '')),
+                              [p.strip() for p in patterns if p.strip()],
+                              output_format = options.get('format', 'cpplint'),
+                              batch = _as_bool(options.get('batch', False)),
+                              max_procs = int(options.get('max_procs', 1)),
+                              batch_size = int(options.get('batch_size', 50)),
+                              engine = engine,
+                              module = options.get('module'),
+                              args = args,
+                              path_sensitive = _as_bool(options.get('path_sensitive', False))))
+    return LinterRegistry(linters)
+
+
+## Interpret a config value as boolean the same way ConfigObj does
+#
+# @param value bool or string from the config
+# @returns boolean
+def _as_bool(value):
+    if isinstance(value, bool):
+        return value
+    return str(value).strip().lower() in ('1', 'true', 'yes', 'on')
+
+
+# seconds a python linter may need beyond the lint budget to finish the
+# file it is checking when the budget runs out
+LINT_RESULT_GRACE = 1.0
+
+# Worker pools of python linters keyed by module, arguments and size. The
+# pools live as long as the process, so a long running controller reuses
+# the imported linters for every commit.
+_LINT_POOLS = {}
+
+# check function of the linter imported by a worker process
+_worker_check = None
+
+# error message if the linter could not be set up in a worker process
+_worker_error = None
+
+
+## Route cpplint error callbacks into structured findings
+#
+# @param module the imported cpplint module
+# @param args list of cpplint command line flags
+# @returns function returning a list of LintFinding objects for one path
+def _cpplint_adapter(module, args):
+    # ParseArguments needs at least one file name to accept the flags
+    module.ParseArguments(list(args) + ['githookcontroller.cc'])
+    findings = []
+
+    def error(filename, linenum, category, confidence, message):
+        if module._ShouldPrintError(category, confidence, linenum):
+            findings.append(LintFinding(filename, linenum, category, confidence, message))
+    module.Error = error
+
+    def check(path):
+        del findings[:]
+        module.ProcessFile(path, module._cpplint_state.verbose_level)
+        return list(findings)
+    return check
+
+
+## Adapter for python linters without builtin support
+#
+# The module needs to provide a function lint_file(path, args) returning
+# (line, category, confidence, message) tuples.
+#
+# @param module the imported linter module
+# @param args list of arguments for the linter
+# @returns function returning a list of LintFinding objects for one path
+def _generic_adapter(module, args):
+    def check(path):
+        return [LintFinding(path, line, category, confidence, message)
+                for line, category, confidence, message in module.lint_file(path, list(args))]
+    return check
+
+PYTHON_LINT_ADAPTERS = {'cpplint' : _cpplint_adapter}
+
+
+## Import a python linter once when a worker process starts
+#
+# Errors are kept and reported for every call instead of raised, the pool
+# would otherwise replace the failing workers forever.
+#
+# @param module_name name of the linter module
+# @param args list of arguments for the linter
+def _init_lint_worker(module_name, args):
+    global _worker_check, _worker_error
+    # cpplint prints its usage and exits on unknown flags
+    stdout, stderr = sys.stdout, sys.stderr
+    sys.stdout = sys.stderr = StringIO()
+    try:
+        module = __import__(module_name)
+        adapter = PYTHON_LINT_ADAPTERS.get(module_name, _generic_adapter)
+        _worker_check = adapter(module, args)
+    except (Exception, SystemExit), e:
+        _worker_error = 'Unable to load python linter %s: %s' % (module_name, e)
+    finally:
+        sys.stdout, sys.stderr = stdout, stderr
+
+
+## Check files with the linter imported in this worker process
+#
+# No further file is started after the deadline, so the files checked
+# until then keep their results when the lint budget runs out.
+#
+# @param paths list of files to check
+# @param deadline time.time() value after which no file is started, None for no limit
+# @returns tuple of a list of LintFinding objects, an error message and
+#          the list of files not checked before the deadline
+def _lint_in_worker(paths, deadline = None):
+    if _worker_error is not None:
+        return [], _worker_error, []
+    findings = []
+    # linters report progress on stdout or stderr, which is not wanted here
+    stdout, stderr = sys.stdout, sys.stderr
+    sys.stdout = sys.stderr = StringIO()
+    try:
+        for i, path in enumerate(paths):
+            if deadline is not None and time.time() >= deadline:
+                return findings, '', paths[i:]
+            findings.extend(_worker_check(path))
+    except Exception, e:
+        return findings, 'Linting %s failed: %s' % (' '.join(paths), e), []
+    finally:
+        sys.stdout, sys.stderr = stdout, stderr
+    return findings, '', []
+
+
+## Get the worker pool of a python linter, create it if needed
+#
+# @param linter Linter object using the python engine
+# @returns multiprocessing.Pool object
+def _get_lint_pool(linter):
+    key = (linter.module, tuple(linter.args), linter.max_procs)
+    if key not in _LINT_POOLS:
+        _LINT_POOLS[key] = multiprocessing.Pool(linter.max_procs,
+                                                _init_lint_worker,
+                                                (linter.module, linter.args))
+    return _LINT_POOLS[key]
+
+
+## Terminate the worker pool of a python linter
+#
+# @param linter Linter object using the python engine
+def _drop_lint_pool(linter):
+    pool = _LINT_POOLS.pop((linter.module, tuple(linter.args), linter.max_procs), None)
+    if pool is not None:
+        pool.terminate()
+        pool.join()
+
+
+## Shut down all linter worker pools
+#
+def close_lint_pools():
+    for pool in _LINT_POOLS.values():
+        pool.close()
+        pool.join()
+    _LINT_POOLS.clear()
+
+atexit.register(close_lint_pools)
+
+
+## Sort files by size, largest first
+#
+# Files which do not exist are sorted last.
+#
+# @param paths iterable of file paths
+# @returns list of paths
+def _largest_first(paths):
+    sizes = {}
+    for path in paths:
+        try:
+            sizes[path] = os.path.getsize(path)
+        except OSError:
+            sizes[path] = -1
+    return sorted(sizes, key = sizes.get, reverse = True)
+
+
+## Format a finding the way cpplint prints it
+#
+# @param finding LintFinding object
+# @returns string
+def _format_finding(finding):
+    text = '%s:%d:  %s  [%s]' % (finding.path, finding.line, finding.message, finding.category)
+    if finding.confidence is not None:
+        text += ' [%d]' % finding.confidence
+    return text
+
+
+## Collects lint findings of all linters of one hook
+#
+# Only the first max_shown findings are printed, all further findings are
+# counted per file and category and shown in a summary table. If a
+# json_path is given, every finding is streamed into a JSON report, so
+# memory use does not grow with the number of findings.
+class LintReport(object):
+
+    ## The constructor.
+    #
+    # @param self The object pointer
+    # @param max_shown maximum number of findings printed
+    # @param json_path path of the JSON report or None
+    def __init__(self, max_shown = 50, json_path = None):
+        self.max_shown = max_shown
+        self.total = 0
+        self.by_path = {}
+        self.by_category = {}
+        self.messages = []
+        self._lock = threading.Lock()
+        self._json = None
+        if json_path:
+            try:
+                self._json = open(json_path, 'w')
+                self._json.write('{"findings": [')
+            except IOError, e:
+                log.error('Unable to write lint report %s: %s' % (json_path, e))
+
+    ## Add a finding
+    #
+    # @param self The object pointer
+    # @param finding LintFinding object
+    def add(self, finding):
+        with self._lock:
+            self.total += 1
+            self.by_path[finding.path] = self.by_path.get(finding.path, 0) + 1
+            self.by_category[finding.category] = self.by_category.get(finding.category, 0) + 1
+            if self.total <= self.max_shown:
+                log.warning(_format_finding(finding))
+            elif self.total == self.max_shown + 1:
+                log.warning('More than %d findings, further findings are only counted' % self.max_shown)
+            if self._json is not None:
+                self._json.write('\n  ' if self.total == 1 else ',\n  ')
+                self._json.write(json.dumps(finding._asdict()))
+
+    ## Add linter output which is not a finding, e.g. an error message
+    #
+    # @param self The object pointer
+    # @param linter Linter object which produced the message
+    # @param message text of the message
+    def add_message(self, linter, message):
+        with self._lock:
+            if len(self.messages) < self.max_shown:
+                log.warning('%s: %s' % (linter.name, message))
+            self.messages.append('%s: %s' % (linter.name, message))
+            del self.messages[self.max_shown:]
+
+    ## Format the summary table
+    #
+    # @param self The object pointer
+    # @param rows maximum number of files and categories listed
+    # @returns summary as string
+    def summary(self, rows = 10):
+        lines = ['%d lint finding(s) in %d file(s)' % (self.total, len(self.by_path))]
+        for title, counts in (('category', self.by_category), ('file', self.by_path)):
+            if not counts:
+                continue
+            lines.append('%8s  %s' % ('count', title))
+            ranked = sorted(counts.items(), key = lambda item: item[1], reverse = True)
+            for name, count in ranked[:rows]:
+                lines.append('%8d  %s' % (count, name))
+            if len(ranked) > rows:
+                lines.append('%8s  ... %d more' % ('', len(ranked) - rows))
+        return '\n'.join(lines)
+
+    ## Print the summary and finish the JSON report
+    #
+    # @param self The object pointer
+    # @param unchecked list of files which were not checked
+    def close(self, unchecked = ()):
+        if self.total > 0:
+            log.warning('\n' + self.summary())
+        if self._json is not None:
+            summary = {'total' : self.total,
+                       'by_path' : self.by_path,
+                       'by_category' : self.by_category,
+                       'messages' : self.messages,
+                       'unchecked' : sorted(set(unchecked))}
+            self._json.write('\n],\n"summary": %s}\n' % json.dumps(summary, indent = 1, sort_keys = True))
+            self._json.close()
+            self._json = None
+
+
 class GitHookController():
 
     ## The constructor.
     #
     # @param self The object pointer
     # @param tempdir Directory where files are stored temporarily outside the repo default: /tmp/
+    #                Doxygen builds and worktrees are staged here, a local disk or tmpfs is best.
     def __init__(self,
                  configfile = 'githookcontroller_default.cfg',
                  tempdir = '/tmp/'):
         self.args = None
+        self.start_time = time.time()
+        self._staged_line_ranges = None
         self.load_config( configfile )
         self.stdin = []
         descr = 'Parser for git message to hook'
@@ -95,14 +2304,50 @@ class GitHookController():
         self.docenv = self.config['general']['docenv']
         self.organisation = self.config['general']['docenv']
         self.vetobranches = list(self.config['general']['vetobranches'])
+        repo_config = {}
+        # repos which are not configured get everything disabled
+        repo_options = ["create_doxy", "doxy_enforce", "lint_enable", "lint_enforce",
+                        "lint_changed_lines"]
+        for attribute in repo_options:
+            setattr(self, attribute, False)
         #Check if repo name in repos section
         if self.remote_root_name in self.config['repos']:
+            repo_config = self.config['repos'][self.remote_root_name]
             # load repo specific options
-            for attribute in ["create_doxy", "doxy_enforce", "lint_enable", "lint_enforce"]:
+            for attribute in repo_options:
                 try:
-                    setattr(self, attribute, bool( self.config['repos'][self.remote_root_name][attribute] ))
-                except KeyError:
+                    setattr(self, attribute, repo_config.as_bool(attribute))
+                except (KeyError, ValueError):
                     setattr(self, attribute, False)
+        self.repo_config = repo_config
+        self.linters = build_linter_registry(repo_config.get('linters'))
+        self.lint_procs = int(repo_config.get('lint_procs', multiprocessing.cpu_count()))
+        self.lint_budget = float(repo_config.get('lint_budget', 0))
+        self.lint_max_findings = int(repo_config.get('lint_max_findings', 50))
+        self.lint_report = repo_config.get('lint_report')
+        self.push_workers = int(repo_config.get('push_workers', multiprocessing.cpu_count()))
+        self.verdict_max_entries = int(repo_config.get('verdict_max_entries', 50000))
+        self.verdict_max_age = float(repo_config.get('verdict_max_age', 90)) * 86400
+        self.doxy_publish = repo_config.get('doxy_publish', 'fast-import')
+        if self.doxy_publish not in ('fast-import', 'checkout'):
+            log.error('Unknown doxy_publish %s, using fast-import' % self.doxy_publish)
+            self.doxy_publish = 'fast-import'
+        self.doxy_staging = repo_config.get('doxy_staging', 'sync')
+        if self.doxy_staging not in ('sync', 'swap', 'off'):
+            log.error('Unknown doxy_staging %s, using sync' % self.doxy_staging)
+            self.doxy_staging = 'sync'
+        self.doxy_dedup = _as_bool(repo_config.get('doxy_dedup', True))
+        self.doxy_max_warnings = int(repo_config.get('doxy_max_warnings', 50))
+        self.doxy_enforce_scope = repo_config.get('doxy_enforce_scope', 'all')
+        if self.doxy_enforce_scope not in ('all', 'files', 'hunks'):
+            log.error('Unknown doxy_enforce_scope %s, using all' % self.doxy_enforce_scope)
+            self.doxy_enforce_scope = 'all'
+        self.doxy_jobs = int(repo_config.get('doxy_jobs', _available_cpus()))
+        self.doxy_overrides = OrderedDict((tag, ' '.join(value) if isinstance(value, list) else value)
+                                          for tag, value in repo_config.get('doxygen', {}).items())
+        self.doxy_patterns = repo_config.get('doxy_patterns', DOXYGEN_PATTERNS)
+        if isinstance(self.doxy_patterns, basestring):
+            self.doxy_patterns = [self.doxy_patterns]
 
 
     ############################
@@ -131,6 +2376,57 @@ class GitHookController():
         stdout = subprocess.Popen(cmd,stdout=subprocess.PIPE,shell=True).communicate()[0].rstrip()
         return stdout
 
+    ## Get path of the .git directory of the repo
+    #
+    # @param self The object pointer
+    # @returns absolute path of the git directory
+    @property
+    def git_dir(self):
+        cmd = ["git", "rev-parse", "--git-dir"]
+        stdout = subprocess.Popen(cmd, stdout=subprocess.PIPE).communicate()[0].rstrip()
+        return os.path.abspath(stdout)
+
+    ## Get the ledger of check results stored in .git/githookcontroller/
+    #
+    # @param self The object pointer
+    # @returns VerdictLedger object
+    @property
+    def verdicts(self):
+        if getattr(self, '_verdicts', None) is None:
+            self._verdicts = VerdictLedger(os.path.join(self.git_dir, 'githookcontroller', 'verdicts'),
+                                           self.verdict_max_entries,
+                                           self.verdict_max_age)
+        return self._verdicts
+
+    ## Hash of the configuration a check depends on
+    #
+    # Any change of the repo configuration invalidates recorded verdicts.
+    #
+    # @param self The object pointer
+    # @param check id of the check
+    # @param extra additional strings the check depends on
+    # @returns hex digest
+    def config_hash(self, check, *extra):
+        config = self.repo_config.dict() if hasattr(self.repo_config, 'dict') else self.repo_config
+        text = json.dumps([check, config, self.vetobranches, extra], sort_keys = True)
+        return hashlib.sha1(text).hexdigest()[:16]
+
+    ## Hash of the lint configuration for one file
+    #
+    # The path is part of the hash if one of the linters of the file is
+    # path sensitive, so a moved file is checked again.
+    #
+    # @param self The object pointer
+    # @param path path relative to the repo root
+    # @returns hex digest
+    def lint_config_hash(self, path):
+        mode = 'changed_lines' if self.lint_changed_lines else 'files'
+        linters = self.linters.lookup(path)
+        extra = [linter.name for linter in linters]
+        if any(linter.path_sensitive for linter in linters):
+            extra.append(path)
+        return self.config_hash('lint', mode, *extra)
+
     ## Get root name of remote (the original repo name)
     #
     # @returns string containing the name of the remote root name
@@ -223,15 +2519,24 @@ class GitHookController():
 
     ## Get list of remote branches
     #
+    # Branch names keep their full path below the remote, e.g. feature/x.
+    #
     # @returns A list of strings containing all remot branch names
     @property
     def remote_branches(self):
         cmd = ["git", "branch", "-r"]
         cmd = [' '.join(cmd)]
         stdout = subprocess.Popen(cmd,stdout=subprocess.PIPE,shell=True).communicate()[0].rstrip().split('\n')
-        stdout = [ st.split('/')[-1] for st in stdout]
-        branches = list( set(stdout) )
-        return stdout
+        branches = []
+        for st in stdout:
+            st = st.strip()
+            # skip empty output and symbolic refs like origin/HEAD -> origin/master
+            if not st or ' -> ' in st:
+                continue
+            branch = st.split('/', 1)[-1]
+            if branch not in branches:
+                branches.append( branch )
+        return branches
 
     ## Checkout another branch
     #
@@ -268,56 +2573,115 @@ class GitHookController():
 
     ## Get list of chagend files in commit
     #
+    # Reads the NUL delimited output of 'git diff --cached --name-status -z'
+    # and yields one ChangedFile record per file as the output arrives.
+    # Renames and copies (R and C status) carry a similarity score and both
+    # paths. src is None for added files, dst is None for deleted files.
+    # The hook is aborted if the output can not be parsed, so that checks
+    # are not silently skipped.
+    #
     # @param self The object pointer
+    # @returns generator of namedtuples of type ChangedFile fields: ['status', 'score', 'src', 'dst']
     def parse_pre_commit(self):
-        cmd = ["git", "diff", "--cached", "--name-status"]
-        cmd = [' '.join(cmd)]
-        proc = subprocess.Popen(cmd,stdout=subprocess.PIPE,shell=True)
-        files = proc.communicate()[0].rstrip().split('\n')
-        try:
-            files = [(f.split('\t')[0] , f.split('\t')[1] ) for f in files]
-        except:
-            files = []
-        return files
+        cmd = ["git", "diff", "--cached", "--name-status", "-z", "-M", "-C"]
+        proc = subprocess.Popen(cmd, stdout=subprocess.PIPE)
+        fields = _iter_nul_fields(proc.stdout)
+        for field in fields:
+            status, score = field[:1], field[1:]
+            try:
+                score = int(score) if score else None
+                if status in 'RC':
+                    yield ChangedFile(status, score, next(fields), next(fields))
+                elif status == 'A':
+                    yield ChangedFile(status, score, None, next(fields))
+                elif status == 'D':
+                    path = next(fields)
+                    yield ChangedFile(status, score, path, None)
+                elif status and status in 'MTUX':
+                    path = next(fields)
+                    yield ChangedFile(status, score, path, path)
+                else:
+                    raise ValueError('unknown status %r' % field)
+            except (StopIteration, ValueError), e:
+                proc.kill()
+                log.error('Unable to parse list of changed files: %s' % (e or 'unexpected end of output'))
+                sys.exit(1)
+        if proc.wait() != 0:
+            log.error('Unable to get list of changed files, git diff exited with %d' % proc.returncode)
+            sys.exit(1)
+
+    ## Get the staged line ranges of all changed files in commit
+    #
+    # Parses the hunk headers of 'git diff --cached -U0', see
+    # _diff_line_ranges. The result is cached for the lifetime of the
+    # controller.
+    #
+    # @param self The object pointer
+    # @returns dict mapping file paths to LineIntervals of changed lines
+    def staged_line_ranges(self):
+        if self._staged_line_ranges is not None:
+            return self._staged_line_ranges
+        # fixed prefixes, diff.mnemonicPrefix or diff.noprefix would change them
+        cmd = ["git", "diff", "--cached", "-U0", "--no-color", "--no-ext-diff",
+               "--src-prefix=a/", "--dst-prefix=b/"]
+        proc = subprocess.Popen(cmd, stdout=subprocess.PIPE)
+        ranges = _diff_line_ranges(proc.stdout)
+        proc.wait()
+        self._staged_line_ranges = ranges
+        return ranges
+
+    ## Get the lines files changed in commits compared to their first parent
+    #
+    # Used to lint pushed blobs like staged files in lint_changed_lines mode.
+    # Root commits are compared to the empty tree.
+    #
+    # @param self The object pointer
+    # @param items iterable of (path, commit SHA) tuples
+    # @returns dict mapping file paths to LineIntervals of changed lines
+    def commit_line_ranges(self, items):
+        by_commit = OrderedDict()
+        for path, commit in items:
+            by_commit.setdefault(commit, []).append(path)
+        ranges = {}
+        for commit, paths in by_commit.items():
+            proc = subprocess.Popen(["git", "rev-parse", "-q", "--verify", commit + "^1"],
+                                    stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+            parent = proc.communicate()[0].strip() or EMPTY_TREE
+            cmd = ["git", "--literal-pathspecs", "diff", "-U0", "--no-color", "--no-ext-diff",
+                   "--no-renames", "--src-prefix=a/", "--dst-prefix=b/", parent, commit, "--"] + paths
+            proc = subprocess.Popen(cmd, stdout=subprocess.PIPE)
+            ranges.update(_diff_line_ranges(proc.stdout))
+            proc.wait()
+        return ranges
 
     ## Parse message from pre-push
     #
     # Based on example in:
     # http://axialcorps.com/2014/06/03/preventing-errant-git-pushes-with-a-pre-push-hook/
     #
+    # The commits are kept as a list, because all refs are needed at once:
+    # the new commits of the push are enumerated for all refs together and
+    # the per ref tasks are joined into one verdict. Only one interned
+    # Commit per ref is kept, the hook input itself is never held in
+    # memory. Callers which handle one ref at a time should use
+    # iter_pre_push_commits() instead.
+    #
     # @param self The object pointer
     # @returns namedtupe of type Push fields: ['commits', 'remote_name', 'remote_url','current_branch', 'removing_remote', 'forcing']
     def parse_pre_push(self):
-        commits = []
         self.parser.add_argument('remote_name')
         self.parser.add_argument('remote_url')
         args = self.parser.parse_args()
-        self.stdin = sys.stdin.read()
-        lines = self.stdin.splitlines()
-        for line in lines:
-            split_line = line.split()
-            if len(split_line) != 4:
-                self.parser.exit(status=1,
-                            message="Could not parse commit from '{}'\n".format(line))
-            # local_branch
-            local_branch = split_line[0].split('/')[-1] if '/' in split_line[0] else None
-            split_line.append(local_branch)
-            # remote_branch
-            remote_branch = split_line[2].split('/')[-1] if '/' in split_line[2] else None
-            split_line.append(remote_branch)
-            commits.append(Commit(*split_line))
-        current_ref = subprocess.Popen(['git', 'symbolic-ref', 'HEAD'],
-                                        stdout=subprocess.PIPE).communicate()[0]
-        current_branch = current_ref.split('/')[-1]
-        pid = os.getppid()
-        push_command = subprocess.Popen(['ps', '-ocommand=', '-p',
-                                        str(pid)],
-                                        stdout=subprocess.PIPE).communicate()[0]
-        forcing = ('--force' in push_command or '-f' in push_command)
+        commits = []
         removing_remote = set()
-        for commit in commits:
+        for commit in self.iter_pre_push_commits():
+            commits.append(commit)
             if commit.local_ref == "(delete)":
                 removing_remote.add(commit.remote_branch)
+        current_ref = subprocess.Popen(['git', 'symbolic-ref', '-q', 'HEAD'],
+                                        stdout=subprocess.PIPE).communicate()[0]
+        current_branch = _branch_name(current_ref.strip())
+        forcing = _is_forced_push(_process_argv(os.getppid()))
 
         return Push(commits=commits,
                     remote_name=args.remote_name,
@@ -326,6 +2690,65 @@ class GitHookController():
                     removing_remote=removing_remote,
                     forcing=forcing)
 
+    ## Read the refs of a push from the pre-push hook input
+    #
+    # Lines are parsed as they arrive, nothing but the current line is
+    # buffered. Ref names and SHAs are interned, so the many refs of a
+    # mirror push pointing to the same commits share their strings.
+    # Branch names keep their full path below refs/heads/, other refs
+    # keep their full ref path.
+    #
+    # @param self The object pointer
+    # @param stream file object to read from, default is stdin
+    # @returns generator of Commit namedtuples
+    def iter_pre_push_commits(self, stream = None):
+        stream = sys.stdin if stream is None else stream
+        for line in iter(stream.readline, ''):
+            split_line = line.split()
+            if not split_line:
+                continue
+            if len(split_line) != 4:
+                self.parser.exit(status=1,
+                            message="Could not parse commit from '{}'\n".format(line.rstrip()))
+            local_ref, local_sha1, remote_ref, remote_sha1 = [intern(field) for field in split_line]
+            yield Commit(local_ref, local_sha1, remote_ref, remote_sha1,
+                         _branch_name(local_ref), _branch_name(remote_ref))
+
+    ## Run per ref tasks of a push in parallel and join their results
+    #
+    # Each task is called as task(controller, push, commit) for every pushed
+    # ref and returns a tuple (passed, message, value). The tasks run on a pool of push_workers
+    # threads. Commits and changed files of the push are computed once
+    # before, so all tasks share them. A task raising an exception fails
+    # for its ref.
+    #
+    # @param self The object pointer
+    # @param push Push namedtuple as returned by parse_pre_push
+    # @param tasks list of task functions
+    # @returns PushVerdict namedtuple
+    def check_push(self, push, tasks):
+        push.new_commits
+        push.changed_files
+
+        def run(item):
+            commit, task = item
+            try:
+                passed, message, value = task(self, push, commit)
+            except Exception, e:
+                passed, message, value = False, '%s: %s' % (type(e).__name__, e), None
+            return RefResult(commit, task.__name__, passed, message, value)
+
+        items = [(commit, task) for commit in push.commits for task in tasks]
+        if not items:
+            return PushVerdict(True, [])
+        pool = ThreadPool(min(self.push_workers, len(items)))
+        try:
+            results = pool.map(run, items, chunksize = max(1, len(items) // (4 * self.push_workers)))
+        finally:
+            pool.close()
+            pool.join()
+        return PushVerdict(all(result.passed for result in results), results)
+
     ###########################################
     ### functions for code style enforcment ###
     ###########################################
@@ -346,31 +2769,306 @@ class GitHookController():
     #
     # @param self The object pointer
     # @param filepath path to the file where lint check should be performed
-    # @return 1 if the check was successful, 0 if not
+    # @return 0 if the check was successful, else a non zero returncode
     def lint_file(self, filepath):
-        if filepath.rsplit(".")[-1] == "cc" or filepath.rsplit(".")[-1] == "hh":
-            return self.lint_cc(filepath)
-        else:
-            return 0
+        return self.lint_files([filepath])
+
+
+    ## Check all files with the linters registered for them
+    #
+    # Files are grouped per linter and batched if the linter supports it.
+    # The linter calls run concurrently, limited by lint_procs overall and
+    # by the max_procs setting of each linter. Large files are checked first
+    # to pack the parallel calls well and to use the lint_budget efficiently.
+    # Files whose staged content already passed with the same configuration
+    # are skipped, the results of the other files are recorded in the
+    # verdict ledger.
+    #
+    # @param self The object pointer
+    # @param filepaths list of paths to check
+    # @return 0 if all checks were successful, else 1
+    @enforce_dectorator("lint_enforce")
+    def lint_files(self, filepaths):
+        blobs = self._staged_blobs(filepaths)
+        filepaths = [path for path in filepaths if path not in blobs or
+                     self.verdicts.lookup('lint', self.lint_config_hash(path), blobs[path]) != 'pass']
+        returncode = self._run_linters(self.linters.dispatch(_largest_first(filepaths)))
+        self.verdicts.record(('lint', self.lint_config_hash(path), blobs[path],
+                              'fail' if path in self.lint_failures else 'pass')
+                             for path in filepaths if path in blobs and self.linters.lookup(path))
+        return returncode
+
+
+    ## Check the content of blobs, e.g. of pushed commits
+    #
+    # The blobs are written to a scratch directory below tempdir, keeping
+    # their paths so the linters are chosen as for the checked out files.
+    # In lint_changed_lines mode only the lines the commit of a blob changed
+    # compared to its first parent are checked, blobs without commit are
+    # checked completely. The results are recorded in the verdict ledger.
+    #
+    # @param self The object pointer
+    # @param blobs iterable of (path, blob SHA) or (path, blob SHA, commit SHA) tuples
+    # @return 0 if all checks were successful, else 1
+    @enforce_dectorator("lint_enforce")
+    def lint_blobs(self, blobs):
+        commits = {}
+        for item in blobs:
+            commits.setdefault(tuple(item[:2]), item[2] if len(item) > 2 else None)
+        # one path may have several versions, each round holds one of them
+        rounds = []
+        for path, blob in sorted(commits):
+            for todo in rounds:
+                if path not in todo:
+                    todo[path] = blob
+                    break
+            else:
+                rounds.append({path : blob})
+        returncode = 0
+        staged_line_ranges = self._staged_line_ranges
+        try:
+            for todo in rounds:
+                if self.lint_changed_lines:
+                    self._staged_line_ranges = self.commit_line_ranges(
+                        (path, commits[(path, blob)]) for path, blob in todo.items()
+                        if commits[(path, blob)] is not None)
+                    for path, blob in todo.items():
+                        if commits[(path, blob)] is None:
+                            self._staged_line_ranges[path] = LineIntervals()
+                            self._staged_line_ranges[path].add(1, sys.maxint)
+                workdir = tempfile.mkdtemp(prefix = 'githookcontroller-', dir = self.tempdir)
+                try:
+                    for path, content in _read_blobs(todo.items()):
+                        target = os.path.join(workdir, path)
+                        if not os.path.isdir(os.path.dirname(target)):
+                            os.makedirs(os.path.dirname(target))
+                        with open(target, 'wb') as blobfile:
+                            blobfile.write(content)
+                    groups = OrderedDict((linter, [os.path.join(workdir, path) for path in paths])
+                                         for linter, paths in self.linters.dispatch(todo).items())
+                    returncode |= self._run_linters(groups, workdir)
+                finally:
+                    shutil.rmtree(workdir, ignore_errors = True)
+                self.verdicts.record(('lint', self.lint_config_hash(path), blob,
+                                      'fail' if path in self.lint_failures else 'pass')
+                                     for path, blob in todo.items())
+        finally:
+            self._staged_line_ranges = staged_line_ranges
+        return returncode
+
+
+    ## Get the blob SHAs of staged files
+    #
+    # Files with unstaged changes are left out, since the linters check the
+    # file in the working tree and not the staged content.
+    #
+    # @param self The object pointer
+    # @param filepaths list of paths relative to the repo root
+    # @returns dict mapping paths to blob SHAs
+    def _staged_blobs(self, filepaths):
+        wanted = set(filepaths)
+        if not wanted:
+            return {}
+        # only the index entries of the checked files are read
+        pathspec = ["--"] + sorted(wanted)
+        proc = subprocess.Popen(["git", "--literal-pathspecs", "diff", "--name-only", "-z"] + pathspec,
+                                stdout=subprocess.PIPE)
+        unstaged = set(_iter_nul_fields(proc.stdout))
+        proc.wait()
+        blobs = {}
+        proc = subprocess.Popen(["git", "--literal-pathspecs", "ls-files", "--stage", "-z"] + pathspec,
+                                stdout=subprocess.PIPE)
+        for entry in _iter_nul_fields(proc.stdout):
+            info, path = entry.split('\t', 1)
+            if path in wanted and path not in unstaged:
+                blobs[path] = info.split()[1]
+        proc.wait()
+        return blobs
 
 
     ## Check if file fulfills cpplint check
     #
     # @param self The object pointer
     # @param filepath path to the file where lint check should be performed
-    # @return 1 if the check was successful, 0 if not
+    # @return 0 if the check was successful, else a non zero returncode
     @enforce_dectorator("lint_enforce")
     def lint_cc(self, filepath):
-        cmd = ["cpplint.py", "--linelength=200", filepath]
-        cmd = [" ".join(cmd)]
-        subp = subprocess.Popen(cmd,
-                                stdout=subprocess.PIPE,
-                                stderr=subprocess.PIPE,
-                                shell=True)
+        linter = self.linters.get('cpplint') or build_linter_registry().get('cpplint')
+        return self._run_linters({linter : [filepath]})
+
+
+    ## Seconds left of the lint time budget of this hook
+    #
+    # The budget starts when the controller is created by the hook.
+    #
+    # @param self The object pointer
+    # @returns remaining seconds or None if there is no budget
+    def _remaining_lint_time(self):
+        if self.lint_budget <= 0:
+            return None
+        return self.start_time + self.lint_budget - time.time()
+
+
+    ## Run linters on their files and report the findings
+    #
+    # Linter output is read line by line and converted into LintFinding
+    # records, which are collected in a LintReport. No new linter calls are
+    # started once the lint_budget is used up and running calls are stopped.
+    # Python linters finish the file they are checking and keep the results
+    # of the files checked so far.
+    # Files which could not be checked in time are reported and fail the
+    # check if lint is enforced.
+    #
+    # The paths of files which failed or were not checked are stored in
+    # lint_failures.
+    #
+    # @param self The object pointer
+    # @param groups dict mapping Linter objects to lists of paths
+    # @param root directory the paths are in, reported paths are made relative to it
+    # @return 0 if all checks were successful, else 1
+    def _run_linters(self, groups, root = None):
+        self.lint_failures = set()
+        jobs = []
+        for linter, paths in groups.items():
+            jobs.append([(linter, cmd, chunk) for cmd, chunk in linter.jobs(paths)])
+        # interleave the jobs of different linters, so workers waiting for
+        # the process limit of one linter do not block the others
+        jobs = [job for round in izip_longest(*jobs) for job in round if job is not None]
+        if not jobs:
+            return 0
+        limits = dict((linter, threading.BoundedSemaphore(linter.max_procs)) for linter in groups)
+        # worker pools are forked before any lint thread is started
+        pools = dict((linter, _get_lint_pool(linter)) for linter in groups if linter.in_process)
+        expired_pools = set()
+        report_path = os.path.join(self.root_path, self.lint_report) if self.lint_report else None
+        report = LintReport(self.lint_max_findings, report_path)
+        if self.lint_changed_lines:
+            # parse the staged hunks once before the lint threads need them
+            self.staged_line_ranges()
 
-        stdout, stderr = subp.communicate()
-        log.warning("\n" + stderr)
-        return subp.returncode
+        # returns the checked files, their returncode and the files which
+        # were not checked in time
+        def run(job):
+            linter, cmd, paths = job
+            with limits[linter]:
+                remaining = self._remaining_lint_time()
+                if remaining is not None and remaining <= 0:
+                    return [], 0, paths
+                if linter in pools:
+                    deadline = None if remaining is None else time.time() + remaining
+                    result = pools[linter].apply_async(_lint_in_worker, (paths, deadline))
+                    try:
+                        findings, error, late = result.get(None if remaining is None
+                                                           else remaining + LINT_RESULT_GRACE)
+                    except multiprocessing.TimeoutError:
+                        expired_pools.add(linter)
+                        return [], 0, paths
+                    nfindings = self._collect_findings(report, findings, root)
+                    if error:
+                        report.add_message(linter, error)
+                    checked = paths[:len(paths) - len(late)]
+                    return checked, 1 if nfindings or error else 0, late
+                if not linter.command:
+                    report.add_message(linter, 'Python module %s not found and no command configured for %s'
+                                       % (linter.module, linter.name))
+                    return paths, 1
+                try:
+                    # own process group, so an expired linter can be stopped
+                    # together with its child processes
+                    proc = subprocess.Popen(cmd,
+                                            stdout=subprocess.PIPE,
+                                            stderr=subprocess.STDOUT,
+                                            preexec_fn=os.setpgrp)
+                except OSError, e:
+                    report.add_message(linter, 'Unable to run %s: %s' % (cmd[0], e))
+                    return paths, 1, []
+                expired = []
+
+                def expire():
+                    expired.append(paths)
+                    try:
+                        os.killpg(proc.pid, signal.SIGKILL)
+                    except OSError:
+                        pass
+                if remaining is not None:
+                    timer = threading.Timer(remaining, expire)
+                    timer.start()
+                # keep the last lines which are no findings to explain failures
+                other = deque(maxlen = 10)
+
+                def findings():
+                    for line in iter(proc.stdout.readline, ''):
+                        finding = linter.parse_finding(line)
+                        if finding is not None:
+                            yield finding
+                        elif line.strip() and not line.startswith(CPPLINT_NOISE):
+                            other.append(line.rstrip())
+                nfindings = self._collect_findings(report, findings(), root)
+                proc.wait()
+                if remaining is not None:
+                    timer.cancel()
+                if expired:
+                    return [], 0, paths
+            if proc.returncode != 0 and nfindings == 0 and other:
+                report.add_message(linter, '\n'.join(other))
+            if self.lint_changed_lines:
+                return paths, 1 if nfindings else 0, []
+            return paths, proc.returncode, []
+
+        pool = ThreadPool(min(self.lint_procs, len(jobs)))
+        returncode = 0
+        unchecked = []
+        failed = []
+        try:
+            for paths, jobcode, late in pool.imap_unordered(run, jobs):
+                if root is not None:
+                    paths = [os.path.relpath(path, root) for path in paths]
+                    late = [os.path.relpath(path, root) for path in late]
+                unchecked.extend(late)
+                if jobcode != 0:
+                    failed.append(paths)
+                    returncode = 1
+        finally:
+            pool.close()
+            pool.join()
+            # workers still busy with an expired call are of no further use
+            for linter in expired_pools:
+                _drop_lint_pool(linter)
+            report.close(unchecked)
+        self.lint_failures.update(unchecked)
+        for paths in failed:
+            # blame files with findings, or all files of a failed linter call
+            self.lint_failures.update([path for path in paths if path in report.by_path] or paths)
+        if unchecked:
+            log_report = log.error if self.lint_enforce else log.warning
+            log_report('Lint time budget of %gs used up, %d file(s) were not checked:\n%s'
+                       % (self.lint_budget, len(unchecked), '\n'.join(sorted(set(unchecked)))))
+            returncode = 1
+        return returncode
+
+
+    ## Add findings to the report, skipping unchanged lines if requested
+    #
+    # File level findings (line 0) are only kept in lint_changed_lines mode
+    # if the first line of the file was changed, e.g. for newly added files.
+    #
+    # @param self The object pointer
+    # @param report LintReport object
+    # @param findings iterable of LintFinding objects
+    # @param root directory the paths of the findings are made relative to or None
+    # @return number of findings added to the report
+    def _collect_findings(self, report, findings, root = None):
+        ranges = self.staged_line_ranges() if self.lint_changed_lines else None
+        nfindings = 0
+        for finding in findings:
+            if root is not None:
+                finding = finding._replace(path = os.path.relpath(finding.path, root))
+            if ranges is not None:
+                if finding.path not in ranges or max(finding.line, 1) not in ranges[finding.path]:
+                    continue
+            report.add(finding)
+            nfindings += 1
+        return nfindings
 
 
     #########################################
@@ -384,19 +3082,27 @@ class GitHookController():
     #   available Tokens:
     #     %branchname% current branch name
     #     %remote_root_name%
-    #     %html_header% path to html header file
-    #     %html_footer% path to html header file
+    #     %output_dir% output directory of the branch
+    #     %header_html% path to html header file
+    #     %footer_html% path to html footer file
     # - header_template.html
     # - footer_template.html
     #   available Tokens:
-    #      +++optionsline+++ a fixed url path
-    #      ++branch_name++ current branch name
+    #      +++optionsline+++ <option> lines of all branches, only for old
+    #                        templates which do not read branches.json
+    #      ++branchname++ current branch name
     #      ++remote_url++ see object property
     #      ++remote_root_name++ see object property
     #
     # @param self The object pointer
-    def prepare_doxygen_cfg(self):
-        if self.current_branch in self.vetobranches:
+    # @param branch branch the documentation is built for, default: current branch
+    # @param configdir directory the config, header and footer are written to, default: doc dir
+    # @param threads number of threads doxygen and dot may use, default: all available CPUs
+    # @returns path of the doxygen config file or None for veto branches
+    def prepare_doxygen_cfg(self, branch = None, configdir = None, threads = None):
+        if branch is None:
+            branch = self.current_branch
+        if branch in self.vetobranches:
             return None
         # check if DOC folder env variable is set
         if os.getenv( self.docenv ) is not None:
@@ -420,83 +3126,175 @@ class GitHookController():
 
         os.chdir( cwd )
 
+        if configdir is None:
+            configdir = docdir
+        elif not os.path.isdir( configdir ):
+            os.makedirs( configdir )
+
         ## prepare footer.html and header.html
-        template_html = {}
+        templates = {}
         header_template_path = os.path.join('', '%s/header_template.html' % docdir )
         footer_template_path = os.path.join('', '%s/footer_template.html' % docdir )
 
-        # check if template files exist and read
+        # check if template files exist and compile them
         if os.path.isfile( header_template_path ):
-            header_path = path = os.path.join('', '%s/header.html' % docdir)
-            with open( header_template_path, "rU+") as header_template:
-                header_html = header_template.read()
-                template_html.update({'header' : header_html } )
+            header_path = os.path.join('', '%s/header.html' % configdir)
+            templates['header'] = DocTemplate.load( header_template_path )
         else:
             header_path = ''
 
         if os.path.isfile( footer_template_path ):
-            doFooter = True
-            footer_path = path = os.path.join('', '%s/footer.html' % docdir)
-            with open( footer_template_path , "rU+") as footer_template:
-                footer_html = footer_template.read()
-                template_html.update( {'footer':footer_html} )
+            footer_path = os.path.join('', '%s/footer.html' % configdir)
+            templates['footer'] = DocTemplate.load( footer_template_path )
         else:
             footer_path = ''
 
-        # prepare linklines and replacements
+        self.doxygen_artifacts = OrderedDict()
+        # the branch list is read from the manifest by the header script
+        branchnames = sorted( set( self.remote_branches ) - set( self.vetobranches ) )
+        self._write_branch_manifest( docdir, branchnames )
+
+        # prepare linklines for old header templates and replacements
         linklines = []
-        for branchname in list( set(self.remote_branches) ):
-            if branchname in self.vetobranches:
-               continue
-            #~ print ( self.organisation, self.doc_remote_root_name, branchname , branchname)
-            linkline = '<option value="http://%s.github.io/%s/%s/doc_%s/html/index.html">%s</option>' % \
-                        ( self.organisation, self.doc_remote_root_name, self.remote_url, branchname, branchname)
+        if any( '+++optionsline+++' in template.tokens for template in templates.values() ):
+            for branchname in branchnames:
+                #~ print ( self.organisation, self.doc_remote_root_name, branchname , branchname)
+                linkline = '<option value="http://%s.github.io/%s/%s/%s/html/index.html">%s</option>' % \
+                            ( self.organisation, self.doc_remote_root_name, self.remote_url, _doc_folder( branchname ), branchname)
 
-            linklines.append( linkline )
+                linklines.append( linkline )
 
-        replacements = { '++branchname++' : self.current_branch,
+        replacements = { '+++optionsline+++' : '\n'.join( linklines ),
+                         '++branchname++' : branch,
                          '++remote_root_name++' : self.remote_root_name,
                          '++remote_url++' : self.remote_url }
 
-        # replace tokens and write files
-        for key in template_html.keys():
-            text = template_html[key]
-            text = text.replace( '+++optionsline+++', '\n'.join( linklines ) )
-            for src, target in replacements.iteritems():
-                text = text.replace(src, target)
-            path = os.path.join('', '%s/%s.html' % (docdir, key))
-            with open(path , "wb" ) as html_file:
-                html_file.write( text )
-        outputdir = os.path.join(docdir, self.remote_root_name,'doc_%s'% self.current_branch)
+        # render templates and write files which changed
+        for key in sorted( templates ):
+            path = os.path.join('', '%s/%s.html' % (configdir, key))
+            self._write_doxygen_artifact( path, templates[key].render( replacements ) )
+        outputdir = self._doxygen_outputdir( docdir, branch )
 
         if not os.path.isdir( outputdir ):
             os.makedirs( outputdir)
         ## prepare main config
-        replacements = { '%branchname%':self.current_branch,
+        replacements = { '%branchname%':branch,
                          '%remote_root_name%' : self.remote_root_name,
                          '%output_dir%' : outputdir,
                          '%footer_html%' : footer_path,
                          '%header_html%' : header_path }
-        path = os.path.join('', '%s/doxy_cfg_template' % docdir  )
-        with open( path, "rU+") as template:
-            text = template.read()
-            for src, target in replacements.iteritems():
-                    text = text.replace(src, target)
-        path = os.path.join( '', '%s/doxy_cfg' % docdir )
-        with open( path, "wb") as config:
-            config.write(text)
+        template = DocTemplate.load( os.path.join('', '%s/doxy_cfg_template' % docdir  ) )
+        path = os.path.join( '', '%s/doxy_cfg' % configdir )
+        text = template.render( replacements ) + self._doxygen_tuning( threads )
+        self._write_doxygen_artifact( path, text )
+        return path
 
-    ## Checkout all doygen folders in gh-pages branch and commit changes
+    ## Write the manifest of branches with documentation of the repo
+    #
+    # <repo>/branches.json on gh-pages lists the branches and the paths of
+    # their documentation relative to it. The header template reads it to
+    # fill the branch chooser, so the generated pages do not change if
+    # branches are added or removed.
+    #
+    # @param self The object pointer
+    # @param docdir the doc directory
+    # @param branchnames list of branch names
+    def _write_branch_manifest(self, docdir, branchnames):
+        repodir = os.path.join( docdir, self.remote_root_name )
+        if not os.path.isdir( repodir ):
+            os.makedirs( repodir )
+        manifest = { 'repo' : self.remote_root_name,
+                     'branches' : [ { 'name' : branchname,
+                                      'path' : '%s/html/index.html' % _doc_folder( branchname ) }
+                                    for branchname in branchnames ] }
+        self._write_doxygen_artifact( os.path.join( repodir, BRANCH_MANIFEST ),
+                                      json.dumps( manifest, indent = 1, sort_keys = True ) + '\n' )
+
+    ## Get the performance settings appended to the doxygen config
+    #
+    # Later assignments override the ones of the template. NUM_PROC_THREADS
+    # needs doxygen 1.9 or newer, HAVE_DOT is only enabled if dot is found.
+    # Tags in the doxygen subsection of the repo config override the
+    # computed values.
+    #
+    # @param self The object pointer
+    # @param threads number of threads, default: all available CPUs
+    # @returns config text
+    def _doxygen_tuning(self, threads = None):
+        if threads is None:
+            threads = _available_cpus()
+        settings = OrderedDict()
+        if _doxygen_version() >= (1, 9):
+            settings['NUM_PROC_THREADS'] = str( threads )
+        settings['HAVE_DOT'] = 'YES' if _which( 'dot' ) else 'NO'
+        settings['DOT_NUM_THREADS'] = str( threads )
+        settings['DOT_CLEANUP'] = 'YES'
+        settings.update( self.doxy_overrides )
+        lines = ['%s = %s' % (tag, value) for tag, value in settings.items()]
+        return '\n# settings added by githookcontroller\n' + '\n'.join( lines ) + '\n'
+
+    ## Write a generated doxygen file if its content changed
+    #
+    # The result is logged and stored in the doxygen_artifacts dict of
+    # path and 'reused' or 'rewritten'.
+    #
+    # @param self The object pointer
+    # @param path path of the file
+    # @param text rendered content
+    def _write_doxygen_artifact(self, path, text):
+        state = 'rewritten' if _write_if_changed( path, text ) else 'reused'
+        self.doxygen_artifacts[path] = state
+        log.info( '%s %s' % (state, path) )
+
+    ## Get the output directory of the documentation of a branch
+    #
+    # @param self The object pointer
+    # @param docdir the doc directory
+    # @param branch name of the branch
+    # @returns path of doc_<branch>
+    def _doxygen_outputdir(self, docdir, branch):
+        return os.path.join(docdir, self.remote_root_name, _doc_folder(branch))
+
+    ## Publish the doygen folders of branches on the gh-pages branch
+    #
+    # Waits for background doxygen builds of the branches first. With
+    # doxy_publish 'fast-import' (default) the doc_<branch> folders are
+    # committed on top of the gh-pages branch of origin without touching the
+    # working tree or index of the doc repo, see _publish_doxygen_fast_import.
+    # With 'checkout', or if that fails, gh-pages is checked out, committed,
+    # pulled and pushed.
     #
+    # @param self The object pointer
+    # @param branchnames list of branch names
     def publish_doxygen( self, branchnames ):
+        self.wait_for_doxygen( branchnames )
         # check if DOC folder env variable is set
         if os.getenv( self.docenv ) is not None:
             docdir = os.path.join('', os.getenv( self.docenv ) )
         else:
-            sys.error( 'Did not find environment variable %s' % self.docenv)
-            sys.error( 'Skipping creation of new documention')
+            log.error( 'Did not find environment variable %s' % self.docenv)
+            log.error( 'Skipping creation of new documention')
             sys.exit(1)
+        if self.doxy_publish == 'fast-import':
+            if self._publish_doxygen_fast_import( docdir, branchnames ):
+                return
+            log.warning( 'Publishing with git fast-import failed, using a checkout of gh-pages' )
+        self._publish_doxygen_checkout( docdir, branchnames )
 
+    ## Checkout all doygen folders in gh-pages branch and commit changes
+    #
+    # Only the doc_<branch> folders of the branches are staged, so git
+    # does not look at the documentation of other branches and repos.
+    # Folders with index hints of synced builds only stage the hinted files,
+    # the others are scanned completely. Afterwards the index matches the
+    # folders, so their hints start empty. Nothing is committed or pushed if
+    # they did not change.
+    #
+    # @param self The object pointer
+    # @param docdir the doc directory
+    # @param branchnames list of branch names
+    def _publish_doxygen_checkout( self, docdir, branchnames ):
+        folders = self._doxygen_folders( docdir, branchnames )
         cwd = os.getcwd()
         # change dir into /doc submodule
         os.chdir( docdir )
@@ -504,11 +3302,37 @@ class GitHookController():
         #make sure doc is set to gh-pages branch
         if not self.current_branch == 'gh-pages':
             self.checkout_branch('gh-pages', True)
-        # commit latests changes
-        self._call_git(['add', '.'])
+        # stage latest changes of the branch folders
+        hinted = [folder for folder in folders if os.path.isfile( os.path.join( folder, DOXYGEN_INDEX_HINTS ) )]
+        scanned = [folder for folder in folders if folder not in hinted]
+        if hinted:
+            paths = []
+            for folder in hinted:
+                with open( os.path.join( folder, DOXYGEN_INDEX_HINTS ), 'rb' ) as hints:
+                    paths.extend( os.path.join( folder, path ) for path in hints.read().split( '\0' ) if path )
+            proc = subprocess.Popen( ['git', 'update-index', '--add', '--remove', '-z', '--stdin'],
+                                     stdin=subprocess.PIPE )
+            proc.communicate( ''.join( path + '\0' for path in sorted( set( paths ) ) ) )
+            if proc.returncode != 0:
+                log.warning( 'Unable to stage the hinted files, staging the folders completely' )
+                scanned = folders
+        if scanned:
+            subprocess.Popen( ['git', 'add', '--all', '--'] + scanned ).communicate()
+            # build stamps and saved warnings are no documentation
+            private = [os.path.join( folder, name ) for folder in scanned if os.path.isdir( folder )
+                       for name in os.listdir( folder ) if name.startswith( DOXYGEN_PRIVATE_PREFIX )]
+            if private:
+                subprocess.Popen( ['git', 'rm', '-q', '--cached', '--ignore-unmatch', '--'] + private ).communicate()
+        for folder in folders:
+            if os.path.isdir( folder ):
+                open( os.path.join( folder, DOXYGEN_INDEX_HINTS ), 'wb' ).close()
+        if not folders or subprocess.call( ['git', 'diff', '--cached', '--quiet', '--'] + folders ) == 0:
+            log.info( 'Documentation of %s did not change, nothing to publish' % ' '.join( branchnames ) )
+            os.chdir( cwd )
+            return
         bname = ' '.join( branchnames )
         msg = '" updated doxygen documentation for branch: %s"' % bname
-        self._call_git([ "commit", "-a" ,"--no-verify", "-m" , msg])
+        self._call_git([ "commit" ,"--no-verify", "-m" , msg])
         #pull latests repo version
         self._call_git(['pull'])
         self._call_git( [ "push", "--no-verify" ,"origin", "gh-pages"] )
@@ -516,6 +3340,128 @@ class GitHookController():
 
         #get back to original repo
         os.chdir( cwd )
+
+    ## Commit doc folders on gh-pages with git fast-import and push the commit
+    #
+    # The new commit is based on the gh-pages branch of origin, or the last
+    # published or local one if it can not be fetched. The doc_<branch> folders of the branches
+    # replace the ones of the parent commit, all other files are kept. If
+    # the push is rejected because gh-pages moved meanwhile, the commit is
+    # built again on top of the new state once.
+    #
+    # @param self The object pointer
+    # @param docdir the doc directory
+    # @param branchnames list of branch names
+    # @returns True if the documentation was pushed
+    def _publish_doxygen_fast_import( self, docdir, branchnames ):
+        folders = self._doxygen_folders( docdir, branchnames )
+        if not folders:
+            log.info( 'No documentation folders to publish' )
+            return True
+        msg = 'updated doxygen documentation for branch: %s' % ' '.join( branchnames )
+        for attempt in range( 2 ):
+            proc = subprocess.Popen( ['git', 'fetch', '-q', 'origin', 'gh-pages'], cwd=docdir,
+                                     env=_git_env(), stderr=subprocess.PIPE )
+            proc.communicate()
+            candidates = ['FETCH_HEAD'] if proc.returncode == 0 else [PUBLISH_REF, 'refs/heads/gh-pages']
+            parent = None
+            for ref in candidates:
+                parent = parent or _git_output( ['git', 'rev-parse', '-q', '--verify', ref + '^{commit}'], docdir )
+            commit = self._fast_import_commit( docdir, parent, folders, msg )
+            if commit is None:
+                return False
+            if parent and _git_output( ['git', 'rev-parse', commit + '^{tree}'], docdir ) == \
+                    _git_output( ['git', 'rev-parse', parent + '^{tree}'], docdir ):
+                subprocess.call( ['git', 'update-ref', PUBLISH_REF, parent], cwd=docdir, env=_git_env() )
+                log.info( 'Documentation of %s did not change, nothing to publish' % ' '.join( branchnames ) )
+                return True
+            proc = subprocess.Popen( ['git', 'push', '--no-verify', '-q', 'origin', '%s:refs/heads/gh-pages' % commit],
+                                     cwd=docdir, env=_git_env(), stdout=subprocess.PIPE, stderr=subprocess.PIPE )
+            stderr = proc.communicate()[1]
+            if proc.returncode == 0:
+                log.info( 'Published documentation of %s as %s' % (' '.join( branchnames ), commit[:7]) )
+                return True
+            log.warning( 'Pushing the documentation failed: %s' % stderr.strip() )
+        return False
+
+    ## Get the existing doc_<branch> folders of branches
+    #
+    # The branch manifest of the repo is published with them.
+    #
+    # @param self The object pointer
+    # @param docdir the doc directory
+    # @param branchnames list of branch names
+    # @returns list of folders and files relative to docdir
+    def _doxygen_folders( self, docdir, branchnames ):
+        folders = []
+        for branch in branchnames:
+            folder = os.path.relpath( self._doxygen_outputdir( docdir, branch ), docdir )
+            if os.path.isdir( os.path.join( docdir, folder ) ):
+                folders.append( folder )
+        manifest = os.path.join( self.remote_root_name, BRANCH_MANIFEST )
+        if folders and os.path.isfile( os.path.join( docdir, manifest ) ):
+            folders.append( manifest )
+        return folders
+
+    ## Write a commit with the content of folders of the doc dir
+    #
+    # Streams the files into git fast-import. The commit is written to
+    # PUBLISH_REF, so the checked out branch, working tree and index of the
+    # doc repo stay as they are. Build stamps and other .doxygen_* files of
+    # the controller are left out.
+    #
+    # @param self The object pointer
+    # @param docdir the doc directory
+    # @param parent SHA of the parent commit or None for a root commit
+    # @param folders folders relative to docdir
+    # @param msg commit message
+    # @returns SHA of the new commit or None on errors
+    def _fast_import_commit( self, docdir, parent, folders, msg ):
+        ident = _git_output( ['git', 'var', 'GIT_COMMITTER_IDENT'], docdir )
+        if ident is None:
+            log.error( 'Unable to get the committer identity of the doc repo' )
+            return None
+        cmd = ['git', 'fast-import', '--quiet', '--done', '--force']
+        proc = subprocess.Popen( cmd, cwd=docdir, env=_git_env(), stdin=subprocess.PIPE )
+        stream = proc.stdin
+        nfiles = nbytes = 0
+        try:
+            stream.write( 'commit %s\ncommitter %s\ndata %d\n%s\n' % (PUBLISH_REF, ident, len( msg ), msg) )
+            if parent:
+                stream.write( 'from %s\n' % parent )
+            for folder in folders:
+                stream.write( 'D %s\n' % _fast_import_path( folder ) )
+                if os.path.isfile( os.path.join( docdir, folder ) ):
+                    walk = [(docdir, [], [folder])]
+                else:
+                    walk = os.walk( os.path.join( docdir, folder ) )
+                for dirpath, dirnames, filenames in walk:
+                    dirnames.sort()
+                    for filename in sorted( filenames ):
+                        if filename.startswith( DOXYGEN_PRIVATE_PREFIX ):
+                            continue
+                        path = os.path.join( dirpath, filename )
+                        relpath = _fast_import_path( os.path.relpath( path, docdir ) )
+                        if os.path.islink( path ):
+                            mode, data = '120000', os.readlink( path )
+                        else:
+                            mode = '100755' if os.access( path, os.X_OK ) else '100644'
+                            with open( path, 'rb' ) as source:
+                                data = source.read()
+                        stream.write( 'M %s inline %s\ndata %d\n' % (mode, relpath, len( data )) )
+                        stream.write( data )
+                        stream.write( '\n' )
+                        nfiles += 1
+                        nbytes += len( data )
+            stream.write( '\ndone\n' )
+            stream.close()
+        except IOError, e:
+            log.error( 'git fast-import failed: %s' % e )
+        if proc.wait() != 0:
+            return None
+        log.info( 'Imported %d files (%.1f MB) into gh-pages' % (nfiles, nbytes / 1e6) )
+        return _git_output( ['git', 'rev-parse', '-q', '--verify', PUBLISH_REF], docdir )
+
     ## Update the doxygen documentation for this folder repo
     #
     # Based on example in:
@@ -535,14 +3481,16 @@ class GitHookController():
         if self.current_branch in self.vetobranches:
             log.info( 'No doxygen documentation for branch %s' % self.current_branch )
             return None
-        log.info( 'updating doxygen documentation' )
         configpath = os.path.join( docdir, 'doxy_cfg')
-        stdout, stderr = current_ref = subprocess.Popen(['doxygen', configpath],
-                                        stdout=subprocess.PIPE).communicate()
-        warnings = self._get_doxygen_warnings()
-        nwarnings = len(warnings)
+        outputdir = self._doxygen_outputdir( docdir, self.current_branch )
+        warn_path = self._run_doxygen( configpath, outputdir, os.getcwd() )
+        self.gc_doxygen_output()
+        scope = self.doxygen_enforce_scope() if getattr( self, 'doxy_enforce', False ) else None
+        check = self.check_doxygen_warnings( self.current_branch, warn_path, os.getcwd(), scope )
+        nwarnings = check.total
         if nwarnings > 0:
-            log.warning('Doxyen produced %d warnings, please check in ./doc/doxy.warn' % nwarnings)
+            where = '' if scope is None else ' in the staged %s' % self.doxy_enforce_scope
+            log.warning('Doxyen produced %d warnings (%d new%s since the last accepted build), please check in ./doc/doxy.warn' % (nwarnings, check.nnew, where))
             log.info('Everybody will love you for great documentation !')
 
             # check if doxgen should be enforced
@@ -550,11 +3498,17 @@ class GitHookController():
             if self.doxy_enforce :
                 log.warning( 'Working in repo %s, please take special care of documentation and fix all doxgen warnings before commit.' % self.root_name)
                 if self.current_branch in 'dev'  or  self.current_branch in 'master' :
-                    log.error( 'You are in branch %s. Doxygen documention is enforced here! No commit until doxy.warn is empty' % self.current_branch)
-                    log.info( '\n'.join(warnings) )
-                    sys.exit(1)
+                    if check.nnew > 0:
+                        log.error( 'You are in branch %s. Doxygen documention is enforced here! No commit until the %d new warnings are fixed' % (self.current_branch, check.nnew))
+                        log.info( '\n'.join( _format_doxygen_warning( warning ) for warning in check.new ) )
+                        if check.nnew > len( check.new ):
+                            log.info( '... and %d more' % (check.nnew - len( check.new )) )
+                        sys.exit(1)
                 else:
                     log.warning( 'You are in branch %s. Better fix errors now or merge commits will be rejected to dev/master in the future' )
+        # the commit is accepted, its warnings are not new anymore
+        self.doxygen_baseline( self.current_branch ).save( check.counts )
+        return nwarnings
         # add new doc to branch
         #~ cmd = [ "git", "add", "doc/doc_%s/" % self.current_branch ]
         #~ print cmd
@@ -565,25 +3519,646 @@ class GitHookController():
         #~ stdout = proc.communicate()[0].rstrip()
 
 
-    ## Get all doxygen warnings
+    ## Run doxygen unless the build stamp of the output is up to date
+    #
+    # The warnings of a build are saved in the output directory and restored
+    # to the warning log if the build is skipped.
+    #
+    # @param self The object pointer
+    # @param configpath path of the doxygen config file
+    # @param outputdir output directory set in the config
+    # @param workdir directory doxygen runs in, the INPUT paths are relative to it
+    # @returns path of the warning log
+    def _run_doxygen(self, configpath, outputdir, workdir):
+        warn_path = os.path.join( workdir, (_doxygen_cfg_values( configpath, 'WARN_LOGFILE' )
+                                            or [DOXYGEN_WARN_PATH])[0] )
+        stamp_path = os.path.join( outputdir, DOXYGEN_STAMP )
+        stamp = self._doxygen_stamp( configpath, workdir )
+        if not os.path.isdir( os.path.dirname( warn_path ) ):
+            os.makedirs( os.path.dirname( warn_path ) )
+        if stamp is not None and stamp == _read_json( stamp_path ) \
+                and os.path.exists( os.path.join( outputdir, DOXYGEN_WARN_COPY ) ):
+            log.info( 'doxygen documentation in %s is up to date' % outputdir )
+            shutil.copyfile( os.path.join( outputdir, DOXYGEN_WARN_COPY ), warn_path )
+        else:
+            log.info( 'updating doxygen documentation in %s' % outputdir )
+            store = self.doc_object_store
+            staging = None
+            if self.doxy_staging != 'off':
+                staging = tempfile.mkdtemp( prefix = 'githookcontroller-stage-', dir = self.tempdir )
+            elif os.path.isdir( outputdir ):
+                # files shared with other branches must not be overwritten,
+                # also if deduplication was switched off meanwhile
+                DocObjectStore.break_links( outputdir )
+                # doxygen does not tell which files it changes
+                if os.path.exists( os.path.join( outputdir, DOXYGEN_INDEX_HINTS ) ):
+                    os.remove( os.path.join( outputdir, DOXYGEN_INDEX_HINTS ) )
+            try:
+                # the config is passed on stdin, so the staging dir does not
+                # change the config file and its build stamp
+                with open( configpath ) as config:
+                    text = config.read()
+                if staging is not None:
+                    text += '\nOUTPUT_DIRECTORY = "%s"\n' % staging
+                with open( os.devnull, 'w' ) as devnull:
+                    proc = subprocess.Popen(['doxygen', '-'], cwd=workdir, stdin=subprocess.PIPE, stdout=devnull)
+                try:
+                    proc.stdin.write( text )
+                    proc.stdin.close()
+                except IOError, e:
+                    log.error( 'Unable to pass the config to doxygen: %s' % e )
+                returncode = self._wait_doxygen( proc, outputdir )
+                if returncode != 0:
+                    log.error( 'doxygen failed with exit code %d for %s' % (returncode, outputdir) )
+                elif staging is not None:
+                    self._install_doxygen_output( staging, outputdir )
+            finally:
+                if staging is not None:
+                    shutil.rmtree( staging, ignore_errors = True )
+            # keep the warnings of this build for the next unchanged commit
+            if os.path.exists( warn_path ) and os.path.isdir( outputdir ):
+                _copy_doxygen_warnings( warn_path, os.path.join( outputdir, DOXYGEN_WARN_COPY ), workdir )
+                if stamp is not None and returncode == 0:
+                    _write_json( stamp_path, stamp )
+            if store is not None:
+                self._dedup_doxygen_output( store, outputdir )
+        return warn_path
+
+    ## Move the output of a staged doxygen build into the doc dir
+    #
+    # With doxy_staging 'sync' only new and changed files are written, with
+    # 'swap' a complete copy replaces the output directory. The throughput
+    # is logged and appended to the stats file.
+    #
+    # A sync appends the written and removed files to the index hints of the
+    # output directory, if the hints cover all changes since the last
+    # publish, i.e. the hints file exists or the directory is new. The
+    # checkout publisher then stages only these files.
+    #
+    # @param self The object pointer
+    # @param staging directory doxygen wrote to
+    # @param outputdir output directory in the doc dir
+    def _install_doxygen_output(self, staging, outputdir):
+        start = time.time()
+        hints_path = os.path.join( outputdir, DOXYGEN_INDEX_HINTS )
+        if self.doxy_staging == 'swap':
+            nfiles, nwritten, nbytes = _swap_directory( staging, outputdir )
+        else:
+            changed = None
+            if not os.path.isdir( outputdir ) or os.path.isfile( hints_path ):
+                changed = []
+            nfiles, nwritten, nbytes = _sync_directory( staging, outputdir, changed )
+            if changed is not None:
+                with open( hints_path, 'ab' ) as hints:
+                    hints.write( ''.join( path + '\0' for path in changed ) )
+        elapsed = time.time() - start
+        log.info( '%s: wrote %d of %d files (%.1f MB) to %s in %.2fs, %.1f MB/s' %
+                  (self.doxy_staging, nwritten, nfiles, nbytes / 1e6, outputdir, elapsed,
+                   nbytes / 1e6 / max( elapsed, 1e-6 )) )
+        self._append_doxygen_stats( { 'time' : int( start ),
+                                      'outputdir' : outputdir,
+                                      'staging' : self.doxy_staging,
+                                      'install' : round( elapsed, 3 ),
+                                      'files' : nfiles,
+                                      'written' : nwritten,
+                                      'bytes' : nbytes } )
+
+    ## Get the store of doxygen output files shared by the branches
+    #
+    # The objects are kept in githookcontroller/doc-objects in the git dir
+    # of the doc repo, so they are not published.
+    #
+    # @param self The object pointer
+    # @returns DocObjectStore object or None if doxy_dedup is off or the doc dir is no git repo
+    @property
+    def doc_object_store(self):
+        if not self.doxy_dedup or os.getenv( self.docenv ) is None:
+            return None
+        if getattr( self, '_doc_object_store', None ) is None:
+            docdir = os.getenv( self.docenv )
+            git_dir = _git_output( ['git', 'rev-parse', '--git-dir'], docdir )
+            if git_dir is None:
+                return None
+            self._doc_object_store = DocObjectStore( os.path.join( docdir, git_dir, 'githookcontroller', 'doc-objects' ) )
+        return self._doc_object_store
+
+    ## Link identical output files to the shared store
+    #
+    # Deduplication is switched off for the controller if the file system
+    # does not support hardlinks.
+    #
+    # @param self The object pointer
+    # @param store DocObjectStore object
+    # @param outputdir output directory of a build
+    def _dedup_doxygen_output(self, store, outputdir):
+        try:
+            nfiles, nlinked, saved = store.dedup( outputdir )
+        except OSError, e:
+            log.warning( 'Unable to deduplicate doxygen output, deduplication is switched off: %s' % e )
+            self.doxy_dedup = False
+            return
+        log.info( 'linked %d of %d files of %s to identical files, %.1f MB saved' %
+                  (nlinked, nfiles, outputdir, saved / 1e6) )
+
+    ## Remove unused objects of the shared store of doxygen output
+    #
+    # @param self The object pointer
+    def gc_doxygen_output(self):
+        store = self.doc_object_store
+        if store is None or not os.path.isdir( store.path ):
+            return
+        nobjects, freed = store.gc()
+        if nobjects:
+            log.info( 'removed %d unused doxygen output files, %.1f MB freed' % (nobjects, freed / 1e6) )
+
+    ## Wait for a doxygen process and record its resource usage
+    #
+    # Wall time, CPU time and peak RSS are logged and appended as a JSON
+    # line to the stats file in .git/githookcontroller/doxygen/.
+    #
+    # @param self The object pointer
+    # @param proc subprocess.Popen object of doxygen
+    # @param outputdir output directory of the build
+    # @returns exit code of doxygen
+    def _wait_doxygen(self, proc, outputdir):
+        start = time.time()
+        while True:
+            try:
+                pid, status, usage = os.wait4( proc.pid, 0 )
+                break
+            except OSError, e:
+                if e.errno != errno.EINTR:
+                    raise
+        proc.returncode = os.WEXITSTATUS( status ) if os.WIFEXITED( status ) else -os.WTERMSIG( status )
+        stats = { 'time' : int( start ),
+                  'outputdir' : outputdir,
+                  'staging' : self.doxy_staging,
+                  'returncode' : proc.returncode,
+                  'wall' : round( time.time() - start, 3 ),
+                  'cpu' : round( usage.ru_utime + usage.ru_stime, 3 ),
+                  'maxrss_kb' : usage.ru_maxrss }
+        log.info( 'doxygen took %(wall).1fs wall time, %(cpu).1fs CPU time, %(maxrss_kb)d kB peak RSS' % stats )
+        self._append_doxygen_stats( stats )
+        return proc.returncode
+
+    ## Append a record to the doxygen stats file
+    #
+    # @param self The object pointer
+    # @param stats JSON serializable dict
+    def _append_doxygen_stats(self, stats):
+        directory = self.doxygen_queue.directory
+        if not os.path.isdir( directory ):
+            os.makedirs( directory )
+        with open( os.path.join( directory, 'stats' ), 'a' ) as statsfile:
+            statsfile.write( json.dumps( stats, sort_keys = True ) + '\n' )
+
+    ## Get the baseline of accepted doxygen warnings of a branch
+    #
+    # @param self The object pointer
+    # @param branch name of the branch
+    # @returns DoxygenBaseline object
+    def doxygen_baseline(self, branch):
+        return DoxygenBaseline( os.path.join( self.doxygen_queue.directory, 'baseline', branch ) )
+
+    ## Compare the warnings of a build with the baseline of the branch
+    #
+    # @param self The object pointer
+    # @param branch name of the branch
+    # @param warn_path path of the warning log
+    # @param root directory the paths in the log are made relative to
+    # @param scope function telling if a new warning counts, see doxygen_enforce_scope
+    # @returns DoxygenCheck namedtuple
+    def check_doxygen_warnings(self, branch, warn_path, root = None, scope = None):
+        baseline = self.doxygen_baseline( branch )
+        if not os.path.exists( warn_path ):
+            return baseline.compare( [] )
+        with open( warn_path ) as warnfile:
+            return baseline.compare( _iter_doxygen_warnings( warnfile, root ), self.doxy_max_warnings, scope )
+
+    ## Get the function restricting doxygen enforcement to the staged changes
+    #
+    # doxy_enforce_scope 'files' only counts warnings in staged files, 'hunks'
+    # only warnings on staged lines, and 'all' every warning. The paths of
+    # the warnings have to be relative to the repo root.
+    #
+    # @param self The object pointer
+    # @returns function taking a DoxygenWarning or None for scope 'all'
+    def doxygen_enforce_scope(self):
+        if self.doxy_enforce_scope == 'files':
+            paths = set( changed_file.dst for changed_file in self.parse_pre_commit()
+                         if changed_file.dst is not None )
+            return lambda warning: warning.path in paths
+        if self.doxy_enforce_scope == 'hunks':
+            ranges = self.staged_line_ranges()
+            return lambda warning: warning.path in ranges and max( warning.line, 1 ) in ranges[warning.path]
+        return None
+
+    ## Accept the warnings of the last build of a branch
+    #
+    # @param self The object pointer
+    # @param branch name of the branch
+    # @returns DoxygenCheck namedtuple of the accepted build or None if there is none
+    def accept_doxygen_warnings(self, branch):
+        if os.getenv( self.docenv ) is None:
+            log.error( 'Did not find environment variable %s' % self.docenv)
+            sys.exit(1)
+        warn_path = os.path.join( self._doxygen_outputdir( os.getenv( self.docenv ), branch ), DOXYGEN_WARN_COPY )
+        if not os.path.exists( warn_path ):
+            return None
+        check = self.check_doxygen_warnings( branch, warn_path )
+        self.doxygen_baseline( branch ).save( check.counts )
+        return check
+
+    ## Build the doxygen documentation of several branches
+    #
+    # Waits for background builds of the branches first, see _build_doxygen_refs.
+    #
+    # @param self The object pointer
+    # @param refs dict of branch name and commit SHA
+    # @returns dict of branch name and DoxygenCheck namedtuple, None for failed builds
+    def build_doxygen(self, refs):
+        self.wait_for_doxygen( list(refs) )
+        return self._build_doxygen_refs( refs )
+
+    ## Build the doxygen documentation of commits in temporary worktrees
+    #
+    # Every commit is checked out in a detached git worktree below tempdir,
+    # or exported with git archive if worktrees are not supported. Config,
+    # header and footer of a branch are written to .git/githookcontroller/
+    # doxygen/config/<branch>/ and doxygen runs in the worktree, so every
+    # build has its own warning log and output directory. Up to doxy_jobs
+    # builds run at the same time.
+    #
+    # @param self The object pointer
+    # @param refs dict of branch name and commit SHA
+    # @returns dict of branch name and DoxygenCheck namedtuple, None for failed builds
+    def _build_doxygen_refs(self, refs):
+        if os.getenv( self.docenv ) is not None:
+            docdir = os.path.join('', os.getenv( self.docenv ) )
+        else:
+            log.error( 'Did not find environment variable %s' % self.docenv)
+            log.error( 'Skipping creation of new documention')
+            sys.exit(1)
+        results = {}
+        jobs = []
+        # CPUs are shared by the concurrent builds
+        threads = max( 1, _available_cpus() // max( 1, self.doxy_jobs ) )
+        scratch = tempfile.mkdtemp( prefix = 'githookcontroller-doxygen-', dir = self.tempdir )
+        try:
+            for i, (branch, commit) in enumerate( sorted( refs.items() ) ):
+                if branch in self.vetobranches:
+                    log.info( 'No doxygen documentation for branch %s' % branch )
+                    continue
+                workdir = os.path.join( scratch, str(i) )
+                if not self._export_commit( commit, workdir ):
+                    log.error( 'Unable to check out %s of branch %s' % (commit, branch) )
+                    results[branch] = None
+                    continue
+                configdir = os.path.join( self.doxygen_queue.directory, 'config', branch )
+                configpath = self.prepare_doxygen_cfg( branch, configdir, threads )
+                jobs.append( (branch, configpath, self._doxygen_outputdir( docdir, branch ), workdir) )
+
+            def run(job):
+                branch, configpath, outputdir, workdir = job
+                try:
+                    warn_path = self._run_doxygen( configpath, outputdir, workdir )
+                    return branch, self.check_doxygen_warnings( branch, warn_path, workdir )
+                except (OSError, IOError), e:
+                    log.error( 'doxygen build for branch %s failed: %s' % (branch, e) )
+                    return branch, None
+
+            if jobs:
+                pool = ThreadPool( max( 1, min( len(jobs), self.doxy_jobs ) ) )
+                try:
+                    results.update( pool.map( run, jobs ) )
+                finally:
+                    pool.close()
+                    pool.join()
+        finally:
+            shutil.rmtree( scratch, ignore_errors = True )
+            subprocess.Popen( ['git', 'worktree', 'prune'], stderr=subprocess.PIPE ).communicate()
+        self.gc_doxygen_output()
+        for branch, check in sorted( results.items() ):
+            if check is not None:
+                log.info( 'doxygen documentation for branch %s: %d warnings, %d new' % (branch, check.total, check.nnew) )
+        return results
+
+    ## Check out a commit into a new directory
+    #
+    # @param self The object pointer
+    # @param commit SHA of the commit
+    # @param workdir directory to create
+    # @returns True on success
+    def _export_commit(self, commit, workdir):
+        cmd = ['git', 'worktree', 'add', '--detach', workdir, commit]
+        # the index of the hook must not become the index of the worktree
+        proc = subprocess.Popen( cmd, env=_git_env(), stdout=subprocess.PIPE, stderr=subprocess.PIPE )
+        proc.communicate()
+        if proc.returncode == 0:
+            return True
+        # git without worktree support
+        if not os.path.isdir( workdir ):
+            os.makedirs( workdir )
+        archive = subprocess.Popen( ['git', 'archive', '--format=tar', commit], stdout=subprocess.PIPE )
+        untar = subprocess.Popen( ['tar', '-x', '-C', workdir], stdin=archive.stdout )
+        archive.stdout.close()
+        untar.communicate()
+        return archive.wait() == 0 and untar.returncode == 0
+
+    ## Compute the build stamp of the doxygen documentation
+    #
+    # The stamp combines a hash over the files doxygen reads, taken from the
+    # staged files plus all uncommitted changes below the INPUT paths, with
+    # the hashes of the config, header and footer files. The config is
+    # hashed without paths and thread settings, see _doxygen_cfg_digest.
+    #
+    # @param self The object pointer
+    # @param configpath path of the doxy_cfg file, header and footer are next to it
+    # @param workdir directory the INPUT paths are relative to
+    # @returns dict or None if the inputs can not be hashed
+    def _doxygen_stamp(self, configpath, workdir):
+        configdir = os.path.dirname( configpath )
+        inputs = [os.path.join( workdir, path ) for path in
+                  _doxygen_cfg_values( configpath, 'INPUT' ) or ['.']]
+        match = self._doxygen_input_matcher( configpath, workdir )
+        input_hash = self._worktree_hash( inputs, workdir, match )
+        if input_hash is None:
+            return None
+        return { 'inputs' : input_hash,
+                 'doxy_cfg' : _doxygen_cfg_digest( configpath ),
+                 'header' : _file_digest( os.path.join( configdir, 'header.html' ) ),
+                 'footer' : _file_digest( os.path.join( configdir, 'footer.html' ) ) }
+
+    ## Get a function telling if doxygen reads a file
+    #
+    # Follows the FILE_PATTERNS, EXCLUDE, EXCLUDE_PATTERNS and RECURSIVE
+    # settings of the config. Without FILE_PATTERNS the doxy_patterns of
+    # the repo are used. The warning log and the output directory are
+    # written by doxygen and never count as input.
+    #
+    # @param self The object pointer
+    # @param configpath path of the doxy_cfg file
+    # @param workdir directory doxygen runs in
+    # @returns function taking an absolute path and returning a boolean
+    def _doxygen_input_matcher(self, configpath, workdir):
+        def values(tag):
+            return _doxygen_cfg_values( configpath, tag )
+
+        def resolve(paths):
+            return [os.path.realpath( os.path.join( workdir, path ) ) for path in paths]
+        inputs = set( resolve( values( 'INPUT' ) or ['.'] ) )
+        excluded = resolve( values( 'EXCLUDE' ) + values( 'OUTPUT_DIRECTORY' )[-1:]
+                            + ( values( 'WARN_LOGFILE' ) or [DOXYGEN_WARN_PATH] )[:1] )
+        recursive = ( values( 'RECURSIVE' ) or ['NO'] )[0].upper() == 'YES'
+        patterns = _pattern_matcher( values( 'FILE_PATTERNS' ) or self.doxy_patterns )
+        exclude_patterns = [re.compile( fnmatch.translate( pattern ) )
+                            for pattern in values( 'EXCLUDE_PATTERNS' )]
+
+        def match(path):
+            if any( path == exclude or path.startswith( exclude + os.sep ) for exclude in excluded ):
+                return False
+            # files listed as INPUT are read whatever their name is
+            if path in inputs:
+                return True
+            if not recursive and os.path.dirname( path ) not in inputs:
+                return False
+            if not patterns( path ):
+                return False
+            # doxygen matches the exclude patterns against the absolute path
+            return not any( regex.match( path ) for regex in exclude_patterns )
+        return match
+
+    ## Hash the content of paths in the working tree using git
+    #
+    # Uses the blob ids of the staged files and only hashes files with
+    # unstaged changes or untracked files on top.
+    #
+    # @param self The object pointer
+    # @param paths list of paths relative to the current directory
+    # @param workdir directory inside the working tree, default: current directory
+    # @param match function taking an absolute path, only files it accepts are hashed
+    # @returns hex digest or None if a path is outside of the working tree
+    def _worktree_hash(self, paths, workdir = None, match = None):
+        env = None
+        if workdir is not None and os.path.realpath( workdir ) != os.path.realpath( self.root_path ):
+            env = _git_env()
+        proc = subprocess.Popen(['git', 'rev-parse', '--show-toplevel'], cwd=workdir, env=env,
+                                stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        root = proc.communicate()[0].rstrip()
+        if proc.returncode != 0 or not root:
+            return None
+        relpaths = []
+        for path in paths:
+            relpath = os.path.normpath( os.path.relpath( os.path.realpath( path ), root ) )
+            if relpath.startswith( '..' ):
+                return None
+            relpaths.append( relpath )
+        if match is None:
+            match = lambda path: True
+        digest = hashlib.sha1()
+        # staged files: <mode> <blob> <stage>\t<path>
+        cmd = ['git', 'ls-files', '--stage', '-z', '--'] + relpaths
+        proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, cwd=root, env=env)
+        for entry in _iter_nul_fields( proc.stdout ):
+            if match( os.path.join( root, entry.split( '\t', 1 )[1] ) ):
+                digest.update( entry + '\0' )
+        if proc.wait() != 0:
+            return None
+        # uncommitted changes and untracked files below the inputs
+        cmd = ['git', 'status', '--porcelain', '-z', '--untracked-files=all', '--'] + relpaths
+        proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, cwd=root, env=env)
+        fields = _iter_nul_fields( proc.stdout )
+        changed = []
+        for entry in fields:
+            source = next( fields, '' ) if entry[0] in 'RC' else ''
+            if not match( os.path.join( root, entry[3:] ) ) \
+                    and not ( source and match( os.path.join( root, source ) ) ):
+                continue
+            digest.update( entry + '\0' + source + '\0' )
+            if os.path.isfile( os.path.join( root, entry[3:] ) ):
+                changed.append( entry[3:] )
+        if proc.wait() != 0:
+            return None
+        if changed:
+            proc = subprocess.Popen(['git', 'hash-object', '--stdin-paths'],
+                                    stdin=subprocess.PIPE, stdout=subprocess.PIPE, cwd=root, env=env)
+            digest.update( proc.communicate( ''.join( path + '\n' for path in changed ) )[0] )
+        return digest.hexdigest()
+
+    ## Get the queue of background doxygen builds stored in .git/githookcontroller/
+    #
+    # @param self The object pointer
+    # @returns DoxygenQueue object
+    @property
+    def doxygen_queue(self):
+        if getattr(self, '_doxygen_queue', None) is None:
+            self._doxygen_queue = DoxygenQueue(os.path.join(self.git_dir, 'githookcontroller', 'doxygen'))
+        return self._doxygen_queue
+
+    ## Check if the documentation is built in the background
+    #
+    # Only repos without doxy_enforce build in the background, enforcing
+    # repos need the warnings before the commit is accepted.
+    #
+    # @param self The object pointer
+    # @returns True if doxygen runs after the commit
+    @property
+    def doxy_background(self):
+        return getattr(self, 'create_doxy', False) and not getattr(self, 'doxy_enforce', False)
+
+    ## Queue a background doxygen build for the current branch
+    #
+    # Starts a detached worker if none is active.
     #
-    def _get_doxygen_warnings(self):
-        doxy_warn_path = './doc/doxy.warn'
-        if os.path.exists(doxy_warn_path):
-            with open( doxy_warn_path ) as warnfile:
-                warnings = warnfile.readlines()
-            return warnings
+    # @param self The object pointer
+    def queue_doxygen(self):
+        branch = self.current_branch
+        if branch in self.vetobranches:
+            log.info( 'No doxygen documentation for branch %s' % branch )
+            return
+        proc = subprocess.Popen(['git', 'rev-parse', 'HEAD'], stdout=subprocess.PIPE)
+        commit = proc.communicate()[0].strip()
+        if self.doxygen_queue.enqueue(branch, commit):
+            log.info( 'doxygen build for branch %s is already queued, updated to %s' % (branch, commit[:7]) )
         else:
-            return []
+            log.info( 'queued doxygen build for branch %s' % branch )
+        if not self.doxygen_queue.worker_alive():
+            self.start_doxygen_worker()
+
+    ## Start a detached process working off the doxygen queue
+    #
+    # The output of the worker is appended to worker.log in the queue directory.
+    #
+    # @param self The object pointer
+    def start_doxygen_worker(self):
+        script = os.path.splitext(os.path.abspath(__file__))[0] + '.py'
+        queue = self.doxygen_queue
+        queue._makedirs()
+        with open(os.devnull) as devnull:
+            with open(queue.log_path, 'a') as logfile:
+                # the worker builds in worktrees, it must not inherit the
+                # index of the commit which queued the job
+                subprocess.Popen([sys.executable, script, 'work'],
+                                 cwd = self.root_path,
+                                 env = _git_env(),
+                                 stdin = devnull,
+                                 stdout = logfile,
+                                 stderr = subprocess.STDOUT,
+                                 close_fds = True,
+                                 preexec_fn = os.setsid)
+
+    ## Build the documentation of all queued jobs
+    #
+    # Returns at once if another worker is active. The worker role is given
+    # up while the queue is locked and empty, so a job queued afterwards
+    # always finds no worker and starts a new one.
+    #
+    # @param self The object pointer
+    def run_doxygen_queue(self):
+        queue = self.doxygen_queue
+        if not queue.acquire_worker():
+            return
+        try:
+            while True:
+                job = queue.take(on_empty = queue.release_worker)
+                if job is None:
+                    break
+                log.info( '%s building doxygen documentation for branch %s at %s' %
+                          (time.strftime('%Y-%m-%d %H:%M:%S'), job['branch'], job['commit'][:7]) )
+                status, warnings = 'failed', None
+                try:
+                    check = self._build_doxygen_refs( {job['branch']: job['commit']} ).get( job['branch'] )
+                    if check is not None:
+                        status, warnings = 'ok', check.total
+                except (SystemExit, Exception), e:
+                    log.error( 'doxygen build for branch %s failed: %s' % (job['branch'], e) )
+                queue.finish(job, status, warnings)
+        finally:
+            queue.release_worker()
+
+    ## Wait until the background doxygen builds are done
+    #
+    # Starts a worker if jobs are pending but no worker is active, e.g.
+    # after a crash of the previous worker.
+    #
+    # @param self The object pointer
+    # @param branches wait only for these branches, None for all
+    # @param timeout maximum time in seconds, None to wait without limit
+    # @returns True if no job is left
+    def wait_for_doxygen(self, branches = None, timeout = None):
+        queue = self.doxygen_queue
+        if not os.path.exists(queue.path):
+            return True
+        deadline = None if timeout is None else time.time() + timeout
+        announced = False
+        while queue.busy(branches):
+            if not queue.worker_alive():
+                self.start_doxygen_worker()
+            if not announced:
+                log.info( 'waiting for background doxygen builds to finish' )
+                announced = True
+            if deadline is not None and time.time() > deadline:
+                return False
+            time.sleep(0.5)
+        return True
+
+    ## Describe the state of the background doxygen builds
+    #
+    # @param self The object pointer
+    # @returns list of lines
+    def doxygen_status(self):
+        state = self.doxygen_queue.state()
+        now = time.time()
+        lines = []
+        running = state['running']
+        if running is not None:
+            lines.append( 'running: %s at %s for %.0fs (pid %d)' %
+                          (running['branch'], running['commit'][:7], now - running['started'], running['pid']) )
+        for branch, job in sorted(state['pending'].items(), key = lambda item: item[1]['queued']):
+            lines.append( 'pending: %s at %s, queued %.0fs ago' % (branch, job['commit'][:7], now - job['queued']) )
+        for branch, job in sorted(state['done'].items()):
+            warnings = '' if job['warnings'] is None else ', %d warnings' % job['warnings']
+            lines.append( 'done: %s at %s %s in %.0fs%s, %.0fs ago' %
+                          (branch, job['commit'][:7], job['status'], job['duration'], warnings, now - job['finished']) )
+        if not self.doxygen_queue.worker_alive() and (state['pending'] or running is not None):
+            lines.append( 'no worker active, run wait to restart it' )
+        return lines or ['no doxygen builds queued']
 
 def main():
-    pass
-    #~ print lines
-    #~ newpush = assemble_push( args, lines )
-    #~ print newpush
-    #~ gitController = GitHookController()
-    #~ push = gitController.parse_pre_push()
-    #~ print push
+    descr = 'Control the doxygen builds of the repo'
+    parser = argparse.ArgumentParser(description= descr)
+    subparsers = parser.add_subparsers(dest = 'command')
+    subparsers.add_parser('status', help = 'show pending, running and finished builds')
+    wait_parser = subparsers.add_parser('wait', help = 'wait until all builds are done')
+    wait_parser.add_argument('--timeout', type = float, default = None,
+                             help = 'maximum time to wait in seconds')
+    wait_parser.add_argument('branches', nargs = '*', help = 'wait only for these branches')
+    subparsers.add_parser('work', help = 'build all queued jobs (used by the hooks)')
+    baseline_parser = subparsers.add_parser('baseline',
+                                            help = 'accept the doxygen warnings of the last build of a branch')
+    baseline_parser.add_argument('branch', nargs = '?', help = 'default: current branch')
+    subparsers.add_parser('gc', help = 'remove doxygen output files not used by any branch anymore')
+    args = parser.parse_args()
+
+    gitController = GitHookController()
+    if args.command == 'status':
+        print '\n'.join( gitController.doxygen_status() )
+    elif args.command == 'wait':
+        if not gitController.wait_for_doxygen( args.branches or None, args.timeout ):
+            print 'Timeout while waiting for doxygen builds'
+            sys.exit(1)
+        print '\n'.join( gitController.doxygen_status() )
+    elif args.command == 'work':
+        gitController.run_doxygen_queue()
+    elif args.command == 'gc':
+        gitController.gc_doxygen_output()
+    elif args.command == 'baseline':
+        branch = args.branch or gitController.current_branch
+        check = gitController.accept_doxygen_warnings( branch )
+        if check is None:
+            print 'No doxygen build found for branch %s' % branch
+            sys.exit(1)
+        print 'Accepted %d doxygen warnings for branch %s' % (check.total, branch)
 
 if __name__=="__main__":
     main()
@@ -3,5 +3,12 @@
 ##
 ## This script performs post-commit actions
 ##
-#doxygen
 
+from githookcontroller import GitHookController
+
+gitController = GitHookController()
+
+# doxygen integration, repos without enforcement build in the background
+# check progress with: python hooks/githookcontroller.py status
+if gitController.doxy_background:
+    gitController.queue_doxygen()
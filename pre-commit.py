@@ -12,14 +12,14 @@ gitController = GitHookController()
 
 # do linting if requested
 if gitController.do_lint:
-    # list of changed files
+    # list of changed files, deleted files can not be linted
     changed_files = gitController.parse_pre_commit()
+    paths = [changed_file.dst for changed_file in changed_files if changed_file.dst is not None]
 
-    # lint each changed files
+    # lint all changed files with the linters registered for them
     allow_commit = True
-    for changed_file in changed_files:
-        if gitController.lint_file(changed_file[1]) is not 0:
-            allow_commit = False
+    if gitController.lint_files(paths) is not 0:
+        allow_commit = False
 
     # if committing is now allowed, exit
     if not allow_commit:
@@ -27,7 +27,8 @@ if gitController.do_lint:
         print "Please address the issue(s) before commiting!"
         sys.exit(1)
 
-# doxygen integration
-if gitController.create_doxy:
+# doxygen integration, enforced documentation has to be checked before
+# the commit, otherwise the documentation is built by post-commit
+if gitController.create_doxy and not gitController.doxy_background:
     gitController.prepare_doxygen_cfg()
     gitController.update_doxygen()
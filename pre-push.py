@@ -25,11 +25,39 @@
 
 
     
-from githookcontroller import GitHookController
+import sys
+
+from githookcontroller import GitHookController, ref_needs_docs, ref_unverified_lint
 
 gitController = GitHookController()
 
-# doxygen integration
 push = gitController.parse_pre_push()
-branchnames = [commit.local_branch for commit in push.commits]
-gitController.publish_doxygen( branchnames )
+# run all per ref checks in parallel
+tasks = [ref_needs_docs]
+if gitController.do_lint:
+    tasks.append( ref_unverified_lint )
+verdict = gitController.check_push( push, tasks )
+if not verdict.passed:
+    print "Push rejected:"
+    print "\n".join( verdict.failures() )
+    sys.exit(1)
+
+# lint files of commits which did not pass the pre-commit hook, e.g. rebased ones
+if gitController.do_lint:
+    unverified = [item for result in verdict.of_task(ref_unverified_lint) for item in result.value]
+    if unverified and gitController.lint_blobs( unverified ) is not 0:
+        print "In this repository and branch, one should stay in line with the code style."
+        print "Please address the issue(s) before pushing!"
+        sys.exit(1)
+
+# doxygen integration, only for branches with changed documented files
+refs = dict( (result.commit.local_branch, result.commit.local_sha1)
+             for result in verdict.of_task(ref_needs_docs) if result.value )
+branchnames = sorted( refs )
+if branchnames:
+    # build the pushed commits of all branches in parallel
+    if gitController.create_doxy:
+        gitController.build_doxygen( refs )
+    gitController.publish_doxygen( branchnames )
+else:
+    print "No documented files changed, documentation is not published."